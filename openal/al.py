@@ -242,3 +242,39 @@ alDopplerFactor = _bind("alDopplerFactor", [ALfloat])
 alDopplerVelocity = _bind("alDopplerVelocity", [ALfloat])
 alSpeedOfSound = _bind("alSpeedOfSound", [ALfloat])
 alDistanceModel = _bind("alDistanceModel", [ALenum])
+
+# AL_SOFT_deferred_updates
+AL_DEFERRED_UPDATES_SOFT = 0xC002
+try:
+    alDeferUpdatesSOFT = _bind("alDeferUpdatesSOFT", None)
+    alProcessUpdatesSOFT = _bind("alProcessUpdatesSOFT", None)
+except AttributeError:
+    alDeferUpdatesSOFT = None
+    alProcessUpdatesSOFT = None
+else:
+    __all__.extend(("AL_DEFERRED_UPDATES_SOFT", "alDeferUpdatesSOFT",
+                    "alProcessUpdatesSOFT"))
+
+# AL_SOFT_events
+AL_EVENT_CALLBACK_FUNCTION_SOFT = 0x19A2
+AL_EVENT_CALLBACK_USER_PARAM_SOFT = 0x19A3
+AL_EVENT_TYPE_BUFFER_COMPLETED_SOFT = 0x19A4
+AL_EVENT_TYPE_SOURCE_STATE_CHANGED_SOFT = 0x19A5
+AL_EVENT_TYPE_DISCONNECTED_SOFT = 0x19A6
+ALEVENTPROCSOFT = ctypes.CFUNCTYPE(None, ALenum, ALuint, ALuint, ALsizei,
+                                   ctypes.POINTER(ALchar), ctypes.c_void_p)
+try:
+    alEventControlSOFT = _bind("alEventControlSOFT",
+                               [ALsizei, ctypes.POINTER(ALenum), ALboolean])
+    alEventCallbackSOFT = _bind("alEventCallbackSOFT",
+                                [ALEVENTPROCSOFT, ctypes.c_void_p])
+except AttributeError:
+    alEventControlSOFT = None
+    alEventCallbackSOFT = None
+else:
+    __all__.extend(("AL_EVENT_CALLBACK_FUNCTION_SOFT",
+                    "AL_EVENT_CALLBACK_USER_PARAM_SOFT",
+                    "AL_EVENT_TYPE_BUFFER_COMPLETED_SOFT",
+                    "AL_EVENT_TYPE_SOURCE_STATE_CHANGED_SOFT",
+                    "AL_EVENT_TYPE_DISCONNECTED_SOFT", "ALEVENTPROCSOFT",
+                    "alEventControlSOFT", "alEventCallbackSOFT"))
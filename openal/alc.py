@@ -124,7 +124,7 @@ alcCloseDevice = _bind("alcCloseDevice", [ctypes.POINTER(ALCdevice)],
 alcGetError = _bind("alcGetError", [ctypes.POINTER(ALCdevice)], ALCenum)
 alcIsExtensionPresent = _bind("alcIsExtensionPresent",
                               [ctypes.POINTER(ALCdevice),
-                               ctypes.POINTER(ALCchar)])
+                               ctypes.POINTER(ALCchar)], ALCboolean)
 alcGetProcAddress = _bind("alcGetProcAddress", [ctypes.POINTER(ALCdevice),
                                                 ctypes.POINTER(ALCchar)],
                           ctypes.c_void_p)
@@ -156,3 +156,56 @@ except AttributeError:
     logger.warning('openAL-soft functions could not be bound')
 else:
     __all__.extend(('alcGetStringiSOFT', 'alcResetDeviceSOFT'))
+
+# ALC_EXT_thread_local_context
+try:
+    alcSetThreadContext = _bind("alcSetThreadContext",
+                                [ctypes.POINTER(ALCcontext)], ALCboolean)
+    alcGetThreadContext = _bind("alcGetThreadContext", None,
+                                ctypes.POINTER(ALCcontext))
+except AttributeError:
+    alcSetThreadContext = None
+    alcGetThreadContext = None
+else:
+    __all__.extend(('alcSetThreadContext', 'alcGetThreadContext'))
+
+# ALC_SOFT_loopback
+ALC_BYTE_SOFT = 0x1400
+ALC_UNSIGNED_BYTE_SOFT = 0x1401
+ALC_SHORT_SOFT = 0x1402
+ALC_UNSIGNED_SHORT_SOFT = 0x1403
+ALC_INT_SOFT = 0x1404
+ALC_UNSIGNED_INT_SOFT = 0x1405
+ALC_FLOAT_SOFT = 0x1406
+ALC_MONO_SOFT = 0x1500
+ALC_STEREO_SOFT = 0x1501
+ALC_QUAD_SOFT = 0x1503
+ALC_5POINT1_SOFT = 0x1504
+ALC_6POINT1_SOFT = 0x1505
+ALC_7POINT1_SOFT = 0x1506
+ALC_FORMAT_CHANNELS_SOFT = 0x1990
+ALC_FORMAT_TYPE_SOFT = 0x1991
+try:
+    alcLoopbackOpenDeviceSOFT = _bind("alcLoopbackOpenDeviceSOFT",
+                                      [ctypes.POINTER(ALCchar)],
+                                      ctypes.POINTER(ALCdevice))
+    alcIsRenderFormatSupportedSOFT = _bind("alcIsRenderFormatSupportedSOFT",
+                                           [ctypes.POINTER(ALCdevice),
+                                            ALCsizei, ALCenum, ALCenum],
+                                           ALCboolean)
+    alcRenderSamplesSOFT = _bind("alcRenderSamplesSOFT",
+                                 [ctypes.POINTER(ALCdevice),
+                                  ctypes.POINTER(ALCvoid), ALCsizei])
+except AttributeError:
+    alcLoopbackOpenDeviceSOFT = None
+    alcIsRenderFormatSupportedSOFT = None
+    alcRenderSamplesSOFT = None
+else:
+    __all__.extend(("ALC_BYTE_SOFT", "ALC_UNSIGNED_BYTE_SOFT",
+                    "ALC_SHORT_SOFT", "ALC_UNSIGNED_SHORT_SOFT",
+                    "ALC_INT_SOFT", "ALC_UNSIGNED_INT_SOFT", "ALC_FLOAT_SOFT",
+                    "ALC_MONO_SOFT", "ALC_STEREO_SOFT", "ALC_QUAD_SOFT",
+                    "ALC_5POINT1_SOFT", "ALC_6POINT1_SOFT", "ALC_7POINT1_SOFT",
+                    "ALC_FORMAT_CHANNELS_SOFT", "ALC_FORMAT_TYPE_SOFT",
+                    "alcLoopbackOpenDeviceSOFT",
+                    "alcIsRenderFormatSupportedSOFT", "alcRenderSamplesSOFT"))
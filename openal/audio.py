@@ -1,12 +1,23 @@
 """Utility classes for OpenAL-based audio access."""
+import asyncio
+from collections import OrderedDict, deque
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 import ctypes
 import os
+import threading
 from . import al, alc
+from .log import logger
 
+try:
+    import numpy  # optional
+except ImportError:
+    numpy = None
 
-__all__ = ["SoundListener", "SoundSource", "SoundData", "SoundSink",
-           "OpenALError",
+
+__all__ = ["SoundListener", "SoundSource", "SourcePool", "SoundData",
+           "StreamingSoundData", "BufferCache", "SoundSink",
+           "LoopbackSoundSink", "OpenALError", "get_buffer_format",
            ]
 
 
@@ -14,6 +25,63 @@ __all__ = ["SoundListener", "SoundSource", "SoundData", "SoundSink",
 _to_ctypes = lambda seq, dtype: (len(seq) * dtype)(*seq)
 _to_python = lambda seq: [x.value for x in seq]
 
+_scratch = threading.local()
+
+# Guards the changedproperties lists of the listeners and sources, which are
+# filled by the application and taken over by SoundSink.update(), possibly on
+# another thread.
+_changelock = threading.Lock()
+
+
+def _scratch_array(_Type, size):
+    """Gets a reusable, thread-local ctypes array for temporary values."""
+    try:
+        return _scratch.arrays[(_Type, size)]
+    except AttributeError:
+        _scratch.arrays = {}
+    except KeyError:
+        pass
+    buf = _scratch.arrays[(_Type, size)] = (_Type * size)()
+    return buf
+
+
+def _get_buffer_pointer(data):
+    """Gets a value for the raw memory of a buffer-protocol object, which can
+    be passed as void pointer to OpenAL without copying the data."""
+    if data is None or isinstance(data, bytes):
+        # ctypes passes bytes objects as pointers to their contents.
+        return data
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        if not data.flags.c_contiguous:
+            raise ValueError("array data must be C-contiguous")
+        return data.ctypes.data
+    view = memoryview(data)
+    if not view.readonly:
+        return (ctypes.c_char * view.nbytes).from_buffer(view)
+    if numpy is not None:
+        # Read-only buffers, such as a mmap opened with ACCESS_READ, are
+        # not supported by from_buffer(), but can be wrapped by numpy.
+        return numpy.frombuffer(view, dtype=numpy.uint8).ctypes.data
+    return view.tobytes()
+
+
+def _resolve_future(future, result):
+    """Sets the result of an asyncio future, unless it is done already."""
+    if not future.done():
+        future.set_result(result)
+
+
+def _fail_future(future, exc):
+    """Sets the exception of an asyncio future, unless it is done
+    already."""
+    if not future.done():
+        future.set_exception(exc)
+
+
+def _ignore_error(operation):
+    """Skips the OpenAL error state check for the operation."""
+    pass
+
 
 # Error handling
 _ERRMAP = {al.AL_NO_ERROR: "No Error",
@@ -44,6 +112,40 @@ def _continue_or_raise(alcdevice=None):
             raise OpenALError(_get_error_message(err))
 
 
+def _check_error(operation):
+    """Raises an OpenALError, if the operation set an error flag."""
+    err = al.alGetError()
+    if err != al.AL_NO_ERROR:
+        raise OpenALError("%s: %s" % (operation, _get_error_message(err)))
+
+
+def _has_extension(name, alcdevice=None):
+    """Checks, whether the AL extension or, if an alcdevice is passed, the
+    ALC extension is supported.
+
+    The result of alIsExtensionPresent() is a c_char, which is true even for
+    AL_FALSE, so it has to be compared by its value.
+    """
+    if alcdevice:
+        return ord(alc.alcIsExtensionPresent(alcdevice, name)) == \
+            alc.ALC_TRUE
+    return ord(al.alIsExtensionPresent(name)) == al.AL_TRUE
+
+
+def _extension_names(propname):
+    """Gets the extension name as bytes and the property name as str for
+    the str or bytes name passed to the add_*_extension() functions."""
+    if isinstance(propname, bytes):
+        propname = propname.decode("ascii")
+    propname = propname.upper()
+    if propname.startswith("AL.AL_"):
+        pname = propname[3:]
+    else:
+        pname = propname
+        propname = "al.AL_%s" % propname
+    return pname.encode("ascii"), propname
+
+
 # Property update handling on SoundListener, SoundData and SoundSource
 _SOURCEPROPMAP = {
     "pitch": al.AL_PITCH,
@@ -124,39 +226,63 @@ def add_buffer_extension(propname, proptype, valuetype, getter, setter):
     """Binds a OpenAL buffer extension to all newly created SoundData/buffer
     instances. Returns True, if the AL buffer extension is supported, False
     otherwise."""
-    propname = propname.upper()
-    if propname.startswith("al.AL_"):
-        pname = propname[3:]
-    else:
-        pname = propname
-        propname = "al.AL_%s" % propname
-    if al.alIsExtensionPresent(pname) == al.AL_FALSE:
+    pname, propname = _extension_names(propname)
+    if not _has_extension(pname):
         return False
 
     global _BUFFERCALLBACKS
     global _BUFFERPROPMAP
-    _BUFFERCALLBACKS[proptype] = (valuetype, getter, setter)
+    _BUFFERCALLBACKS[proptype] = (valuetype, setter, getter)
     _BUFFERPROPMAP[propname] = proptype
     return True
 
 _LISTENERCALLBACKS = {
-        al.AL_GAIN: (1, al.ALfloat, al.alListenerf, al.alListenerf),
+        al.AL_GAIN: (1, al.ALfloat, al.alListenerf, al.alGetListenerf),
         al.AL_POSITION: (3, al.ALfloat, al.alListenerfv, al.alGetListenerfv),
         al.AL_VELOCITY: (3, al.ALfloat, al.alListenerfv, al.alGetListenerfv),
         al.AL_ORIENTATION: (6, al.ALfloat, al.alListenerfv, al.alGetListenerfv),
         }
+
+
+def _make_listener_accessors(prop, size, _Type, setter, getter):
+    """Creates the setter and getter functions for a OpenAL listener
+    property."""
+    if size == 1:
+        def set_value(value):
+            setter(prop, value)
+    elif size == 3 and setter is al.alListenerfv:
+        listener3f = al.alListener3f
+        def set_value(value):
+            x, y, z = value
+            listener3f(prop, x, y, z)
+    else:
+        def set_value(value):
+            buf = _scratch_array(_Type, size)
+            buf[:] = value
+            setter(prop, buf)
+
+    def get_value():
+        buf = _scratch_array(_Type, size)
+        getter(prop, buf)
+        if size == 1:
+            return buf[0]
+        return buf[:]
+    return set_value, get_value
+
+
+_LISTENERSETTERS = {}
+_LISTENERGETTERS = {}
+for _prop, _cb in _LISTENERCALLBACKS.items():
+    _LISTENERSETTERS[_prop], _LISTENERGETTERS[_prop] = \
+        _make_listener_accessors(_prop, *_cb)
+
+
 def _get_listener_value(prop):
     """Gets the requested OpenAL listener property value."""
-    size, _Type, setter, getter = _LISTENERCALLBACKS[prop]
-    v = (_Type * size)()
-    getter(prop, v)
-    return v
+    return _LISTENERGETTERS[prop]()
 def _set_listener_value(prop, value):
     """Sets a OpenAL listener property value."""
-    size, _Type, setter, getter = _LISTENERCALLBACKS[prop]
-    if size > 1:
-        value = _to_ctypes(value, _Type)
-    setter(prop, value)
+    _LISTENERSETTERS[prop](value)
 
 
 def add_listener_extension(propname, proptype, vcount, valuetype, getter,
@@ -164,19 +290,16 @@ def add_listener_extension(propname, proptype, vcount, valuetype, getter,
     """Binds a OpenAL listener extension to all newly created SoundListener
     instances. Returns True, if the listener extension is supported, False
     otherwise."""
-    propname = propname.upper()
-    if propname.startswith("al.AL_"):
-        pname = propname[3:]
-    else:
-        pname = propname
-        propname = "al.AL_%s" % propname
-    if al.alIsExtensionPresent(pname) == al.AL_FALSE:
+    pname, propname = _extension_names(propname)
+    if not _has_extension(pname):
         return False
 
     global _LISTENERCALLBACKS
     global _LISTENERPROPMAP
-    _LISTENERCALLBACKS[proptype] = (vcount, valuetype, getter, setter)
+    _LISTENERCALLBACKS[proptype] = (vcount, valuetype, setter, getter)
     _LISTENERPROPMAP[propname] = proptype
+    _LISTENERSETTERS[proptype], _LISTENERGETTERS[proptype] = \
+        _make_listener_accessors(proptype, *_LISTENERCALLBACKS[proptype])
     return True
 
 
@@ -204,37 +327,129 @@ _SOURCECALLBACKS = {
         al.AL_SAMPLE_OFFSET: (1, al.ALfloat, al.alSourcef, al.alGetSourcef),
         al.AL_BYTE_OFFSET: (1, al.ALfloat, al.alSourcef, al.alGetSourcef),
         }
+
+
+def _make_source_accessors(prop, size, _Type, setter, getter):
+    """Creates the setter and getter functions for a OpenAL source
+    property.
+
+    Scalars and 3-value vectors are passed directly to OpenAL, other vectors
+    are copied into a thread-local scratch array, so that no ctypes objects
+    need to be created on setting a value.
+    """
+    if setter is None:
+        def set_value(sourceid, value):
+            raise OpenALError("source property 0x%x is read-only" % prop)
+    elif size == 1:
+        def set_value(sourceid, value):
+            setter(sourceid, prop, value)
+    elif size == 3 and setter is al.alSourcefv:
+        source3f = al.alSource3f
+        def set_value(sourceid, value):
+            x, y, z = value
+            source3f(sourceid, prop, x, y, z)
+    else:
+        def set_value(sourceid, value):
+            buf = _scratch_array(_Type, size)
+            buf[:] = value
+            setter(sourceid, prop, buf)
+
+    def get_value(sourceid):
+        buf = _scratch_array(_Type, size)
+        getter(sourceid, prop, buf)
+        if size == 1:
+            return buf[0]
+        return buf[:]
+    return set_value, get_value
+
+
+_SOURCESETTERS = {}
+_SOURCEGETTERS = {}
+for _prop, _cb in _SOURCECALLBACKS.items():
+    _SOURCESETTERS[_prop], _SOURCEGETTERS[_prop] = \
+        _make_source_accessors(_prop, *_cb)
+
+
 def _get_source_value(sourceid, prop):
     """Gets the requested OpenAL source property value."""
-    size, _Type, setter, getter = _SOURCECALLBACKS[prop]
-    v = (_Type * size)()
-    getter(sourceid, prop, v)
-    return v
+    return _SOURCEGETTERS[prop](sourceid)
 def _set_source_value(sourceid, prop, value):
     """Sets a OpenAL source property value."""
-    size, _Type, setter, getter = _SOURCECALLBACKS[prop]
-    if size > 1:
-        value = _to_ctypes(value, _Type)
-    setter(sourceid, prop, value)
+    _SOURCESETTERS[prop](sourceid, value)
+
+
+# The fields of SoundSink.snapshot() and the source properties filling them.
+_SNAPSHOTFIELDS = (
+        ("state", al.AL_SOURCE_STATE, "i4", ()),
+        ("sec_offset", al.AL_SEC_OFFSET, "f4", ()),
+        ("buffers_queued", al.AL_BUFFERS_QUEUED, "i4", ()),
+        ("buffers_processed", al.AL_BUFFERS_PROCESSED, "i4", ()),
+        ("position", al.AL_POSITION, "f4", (3,)),
+        ("gain", al.AL_GAIN, "f4", ()),
+        )
+
+
+# The initial values of the writable OpenAL source properties, which are
+# restored, before a source id is handed to another SoundSource.
+_SOURCEDEFAULTS = {
+        al.AL_PITCH: 1.0,
+        al.AL_GAIN: 1.0,
+        al.AL_MAX_DISTANCE: 3.40282347e+38,
+        al.AL_ROLLOFF_FACTOR: 1.0,
+        al.AL_REFERENCE_DISTANCE: 1.0,
+        al.AL_MIN_GAIN: 0.0,
+        al.AL_MAX_GAIN: 1.0,
+        al.AL_CONE_OUTER_GAIN: 0.0,
+        al.AL_CONE_INNER_ANGLE: 360.0,
+        al.AL_CONE_OUTER_ANGLE: 360.0,
+        al.AL_POSITION: [0, 0, 0],
+        al.AL_VELOCITY: [0, 0, 0],
+        al.AL_DIRECTION: [0, 0, 0],
+        al.AL_SOURCE_RELATIVE: al.AL_FALSE,
+        al.AL_LOOPING: al.AL_FALSE,
+        }
+
+
+def _shadow_value(value):
+    """Converts a property value into its form stored in the shadow caches
+    of a SoundSink."""
+    if hasattr(value, "__len__"):
+        return tuple(value)
+    return value
+
+
+def _same_value(last, value, epsilon):
+    """Checks, whether the value equals the last pushed value within the
+    passed epsilon."""
+    if isinstance(last, tuple):
+        if len(last) != len(value):
+            return False
+        for a, b in zip(last, value):
+            if abs(a - b) > epsilon:
+                return False
+        return True
+    return abs(last - value) <= epsilon
+
+
+# The values of a newly generated OpenAL source id.
+_SOURCESHADOW = dict((prop, _shadow_value(value))
+                     for prop, value in _SOURCEDEFAULTS.items())
 
 
 def add_source_extension(propname, proptype, vcount, valuetype, getter, setter):
     """Binds a OpenAL source extension to all newly created SoundSource
     instances. Returns True, if the AL source extension is supported, False
     otherwise."""
-    propname = propname.upper()
-    if propname.startswith("al.AL_"):
-        pname = propname[3:]
-    else:
-        pname = propname
-        propname = "al.AL_%s" % propname
-    if al.alIsExtensionPresent(pname) == al.AL_FALSE:
+    pname, propname = _extension_names(propname)
+    if not _has_extension(pname):
         return False
 
     global _SOURCECALLBACKS
     global _SOURCEPROPMAP
-    _SOURCECALLBACKS[proptype] = (vcount, valuetype, getter, setter)
+    _SOURCECALLBACKS[proptype] = (vcount, valuetype, setter, getter)
     _SOURCEPROPMAP[propname] = proptype
+    _SOURCESETTERS[proptype], _SOURCEGETTERS[proptype] = \
+        _make_source_accessors(proptype, *_SOURCECALLBACKS[proptype])
     return True
 
 
@@ -262,27 +477,86 @@ class OpenALError(Exception):
         return repr(self.msg)
 
 
+# The buffer formats for (channels, bits) pairs. 32 bits denote float
+# samples.
+_FORMATS = {
+    (1, 8): al.AL_FORMAT_MONO8,
+    (2, 8): al.AL_FORMAT_STEREO8,
+    (1, 16): al.AL_FORMAT_MONO16,
+    (2, 16): al.AL_FORMAT_STEREO16,
+    }
+# The buffer formats of AL_EXT_float32 and AL_EXT_MCFORMATS, which are
+# looked up via alGetEnumValue(), if the extension is supported.
+_EXTFORMATS = {
+    (1, 32): (b"AL_EXT_float32", b"AL_FORMAT_MONO_FLOAT32"),
+    (2, 32): (b"AL_EXT_float32", b"AL_FORMAT_STEREO_FLOAT32"),
+    (4, 8): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_QUAD8"),
+    (4, 16): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_QUAD16"),
+    (4, 32): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_QUAD32"),
+    (6, 8): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_51CHN8"),
+    (6, 16): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_51CHN16"),
+    (6, 32): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_51CHN32"),
+    (7, 8): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_61CHN8"),
+    (7, 16): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_61CHN16"),
+    (7, 32): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_61CHN32"),
+    (8, 8): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_71CHN8"),
+    (8, 16): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_71CHN16"),
+    (8, 32): (b"AL_EXT_MCFORMATS", b"AL_FORMAT_71CHN32"),
+    }
+
+
+def get_buffer_format(channels, bitrate):
+    """Gets the OpenAL buffer format for the passed amount of channels and
+    bits per sample, with 32 bits denoting float samples.
+
+    Formats of extensions are only available, if the current context
+    supports them. Returns None, if the format is not supported.
+    """
+    dformat = _FORMATS.get((channels, bitrate), None)
+    if dformat is not None:
+        return dformat
+    extension = _EXTFORMATS.get((channels, bitrate), None)
+    if extension is None:
+        return None
+    extname, enumname = extension
+    if not _has_extension(extname):
+        return None
+    dformat = al.alGetEnumValue(enumname)
+    if dformat in (0, -1):
+        return None
+    _FORMATS[(channels, bitrate)] = dformat
+    return dformat
+
+
 class SoundData(object):
     """A buffered audio object.
 
     The SoundData consists of a PCM audio data buffer, the audio frequency
     and additional format information to allow easy buffering through OpenAL.
+    The data can be any object supporting the buffer protocol, such as bytes,
+    bytearray, memoryview, mmap or numpy arrays, and is passed to OpenAL
+    without copying it.
     """
     def __init__(self, data=None, channels=None, bitrate=None, size=None,
                  frequency=None, dformat=None):
-        """Creates a new SoundData object."""
+        """Creates a new SoundData object.
+
+        If no size is provided, the byte size of the data is used.
+        """
+        if size is None and data is not None:
+            try:
+                size = memoryview(data).nbytes
+            except TypeError:
+                pass
         self.channels = channels
         self.bitrate = bitrate
         self.size = size
         self.frequency = frequency
         self.data = data
         if dformat is None:
-            formatmap = {(1, 8): al.AL_FORMAT_MONO8,
-                         (2, 8): al.AL_FORMAT_STEREO8,
-                         (1, 16): al.AL_FORMAT_MONO16,
-                         (2, 16): al.AL_FORMAT_STEREO16
-                         }
-            dformat = formatmap.get((channels, bitrate), None)
+            # Formats of extensions are resolved by the SoundSink, once a
+            # context is available.
+            dformat = _FORMATS.get((channels, bitrate), None)
         self.format = dformat
 
 
@@ -292,6 +566,10 @@ class StreamingSoundData(SoundData):
     The StreamingSoundData consists of a PCM audio stream, the audio frequency
     and format information. It reads and fills a buffer automatically on
     underruns.
+
+    The stream has to provide a read(size) method, which returns a
+    buffer-protocol object of up to size bytes and an empty one, once it is
+    exhausted. A SoundSink closes the stream, once it is exhausted.
     """
     def __init__(self, stream=None, channels=None, bitrate=None, size=None,
                  frequency=None):
@@ -309,6 +587,12 @@ class StreamingSoundData(SoundData):
     def tell(self):
         return self.data.tell()
 
+    def close(self):
+        """Closes the stream, if it provides a close() method."""
+        close = getattr(self.data, "close", None)
+        if close is not None:
+            close()
+
 
 class SoundListener(object):
     """A listener object within the 3D audio space."""
@@ -342,8 +626,9 @@ class SoundListener(object):
             raise AttributeError("object %r has no attribute %r" % \
                                      (self.__class__.__name__, name))
         self.dataproperties[dprop] = value
-        if dprop not in self.changedproperties:
-            self.changedproperties.append(dprop)
+        with _changelock:
+            if dprop not in self.changedproperties:
+                self.changedproperties.append(dprop)
 
     def __delattr__(self, name):
         if name in ("dataproperties", "changedproperties"):
@@ -361,11 +646,24 @@ class SoundListener(object):
         return len(self.changedproperties) != 0
 
 
+# Plain instance attributes of a SoundSource, which are not mapped to
+# OpenAL source properties.
+_SOURCEATTRS = ("dataproperties", "changedproperties", "bufferqueue",
+                "priority", "_activesets")
+
+
 class SoundSource(object):
     """An object within the application world, which can emit sounds."""
     def __init__(self, gain=1.0, pitch=1.0, position=[0, 0, 0],
-                 velocity=[0, 0, 0]):
+                 velocity=[0, 0, 0], priority=0):
         self.bufferqueue = []
+        # Sources with a lower priority lose their OpenAL source id first,
+        # if a SoundSink runs out of them.
+        self.priority = priority
+        # The active source sets of the SoundSink instances, the source is
+        # bound to. The source adds itself to them, whenever it needs to be
+        # processed.
+        self._activesets = []
         self.dataproperties = {}
         self.dataproperties[al.AL_GAIN] = gain
         self.dataproperties[al.AL_PITCH] = pitch
@@ -375,7 +673,7 @@ class SoundSource(object):
                                   al.AL_VELOCITY]
 
     def __getattr__(self, name):
-        if name in ("dataproperties", "changedproperties", "bufferqueue"):
+        if name in _SOURCEATTRS:
             return super(SoundSource, self).__getattr__(name)
         dprop = _SOURCEPROPMAP.get(name, None)
         if dprop is None:
@@ -386,18 +684,20 @@ class SoundSource(object):
         return self.dataproperties.get(dprop, None)
 
     def __setattr__(self, name, value):
-        if name in ("dataproperties", "changedproperties", "bufferqueue"):
+        if name in _SOURCEATTRS:
             return super(SoundSource, self).__setattr__(name, value)
         dprop = _SOURCEPROPMAP.get(name, None)
         if dprop is None:
             raise AttributeError("object %r has no attribute %r" % \
                                      (self.__class__.__name__, name))
         self.dataproperties[dprop] = value
-        if dprop not in self.changedproperties:
-            self.changedproperties.append(dprop)
+        with _changelock:
+            if dprop not in self.changedproperties:
+                self.changedproperties.append(dprop)
+        self._activate()
 
     def __delattr__(self, name):
-        if name in ("dataproperties", "changedproperties", "bufferqueue"):
+        if name in _SOURCEATTRS:
             return super(SoundSource, self).__delattr__(name)
         dprop = _SOURCEPROPMAP.get(name, None)
         if dprop is None:
@@ -411,9 +711,204 @@ class SoundSource(object):
         update."""
         return len(self.changedproperties) != 0
 
+    def _activate(self):
+        """Marks the SoundSource as requiring processing on its bound
+        SoundSink instances."""
+        for activeset in self._activesets:
+            activeset.add(self)
+
     def queue(self, sounddata):
         """Adds a SoundData object for playback to the SoundSource."""
         self.bufferqueue.append(sounddata)
+        self._activate()
+
+
+class SourcePool(object):
+    """A fixed-size group of sound sources with array-backed properties.
+
+    The position, velocity and direction of all sources are kept in
+    contiguous (count, 3) float32 arrays, the gain and pitch in (count,)
+    float32 arrays. Changes are tracked in a dirty bitmask per source, so
+    that a SoundSink can push them in a single pass.
+    """
+    POSITION = 0x01
+    VELOCITY = 0x02
+    DIRECTION = 0x04
+    GAIN = 0x08
+    PITCH = 0x10
+
+    # (attribute, dirty flag, OpenAL property, value count)
+    _PROPERTIES = (("position", POSITION, al.AL_POSITION, 3),
+                   ("velocity", VELOCITY, al.AL_VELOCITY, 3),
+                   ("direction", DIRECTION, al.AL_DIRECTION, 3),
+                   ("gain", GAIN, al.AL_GAIN, 1),
+                   ("pitch", PITCH, al.AL_PITCH, 1),
+                   )
+    _FLAGS = dict((name, flag) for name, flag, prop, size in _PROPERTIES)
+
+    def __init__(self, count, gain=1.0, pitch=1.0):
+        """Creates a new SourcePool for count sources."""
+        if numpy is None:
+            raise RuntimeError("SourcePool requires numpy")
+        self.count = count
+        self.position = numpy.zeros((count, 3), dtype=numpy.float32)
+        self.velocity = numpy.zeros((count, 3), dtype=numpy.float32)
+        self.direction = numpy.zeros((count, 3), dtype=numpy.float32)
+        self.gain = numpy.full(count, gain, dtype=numpy.float32)
+        self.pitch = numpy.full(count, pitch, dtype=numpy.float32)
+        self.dirty = numpy.full(count, self.POSITION | self.VELOCITY |
+                                self.GAIN | self.PITCH, dtype=numpy.uint8)
+        self.bufferqueues = [[] for i in range(count)]
+        # Indices of the sources, which have sounds queued or playing.
+        self._active = set()
+
+    def __len__(self):
+        return self.count
+
+    def set(self, name, values, index=slice(None)):
+        """Sets the values of the named property for the sources at index
+        and marks them as changed."""
+        flag = self._FLAGS[name]
+        getattr(self, name)[index] = values
+        self.dirty[index] |= flag
+
+    def mark_dirty(self, name=None, index=slice(None)):
+        """Marks the named property (or all properties, if name is None)
+        of the sources at index as changed.
+
+        This has to be called after modifying the property arrays in-place.
+        """
+        if name is None:
+            flag = 0
+            for pname, pflag, prop, size in self._PROPERTIES:
+                flag |= pflag
+        else:
+            flag = self._FLAGS[name]
+        self.dirty[index] |= flag
+
+    @property
+    def changed(self):
+        """Indicates, that one or more properties changed since the last
+        update."""
+        return bool(self.dirty.any())
+
+    def queue(self, index, sounddata):
+        """Adds a SoundData object for playback to the source at index."""
+        self.bufferqueues[index].append(sounddata)
+        self._active.add(index)
+
+
+class BufferCache(object):
+    """A cache of OpenAL buffers for static SoundData objects.
+
+    The BufferCache maps SoundData objects to buffers, which already
+    contain their PCM data, so that playing the same sound repeatedly does
+    not upload it again. If the cached data exceeds the byte budget, the
+    least recently used buffers, which are not queued on any source, are
+    deleted.
+    """
+    def __init__(self, budget=32 * 1024 * 1024):
+        """Creates a new BufferCache with the passed byte budget."""
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Called with the name of each OpenAL operation to check the error
+        # state. A SoundSink sets it according to its error policy.
+        self.check = _check_error
+        # SoundData -> [buffer id, byte size, queue count]
+        self._entries = OrderedDict()
+        self._buffers = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, sounddata):
+        return sounddata in self._entries
+
+    def acquire(self, sounddata):
+        """Gets the buffer id for the passed SoundData and marks it as being
+        queued. Returns None, if the SoundData is not cached."""
+        entry = self._entries.get(sounddata, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(sounddata)
+        entry[2] += 1
+        return entry[0]
+
+    def add(self, sounddata, bufid, size):
+        """Adds the buffer id holding the data of the passed SoundData to
+        the cache and marks it as being queued."""
+        entry = [bufid, size, 1]
+        self._entries[sounddata] = entry
+        self._buffers[bufid] = (sounddata, entry)
+        self.size += size
+        self.evict()
+
+    def release(self, bufid):
+        """Marks a buffer, which got unqueued from a source, as not being
+        queued anymore. Returns True, if the buffer belongs to the cache,
+        False otherwise."""
+        item = self._buffers.get(bufid, None)
+        if item is None:
+            return False
+        item[1][2] -= 1
+        if self.size > self.budget:
+            self.evict()
+        return True
+
+    def evict(self, budget=None):
+        """Deletes the least recently used, unqueued buffers, until the
+        cached data fits into the budget."""
+        if budget is None:
+            budget = self.budget
+        if self.size <= budget:
+            return
+        for sounddata, entry in list(self._entries.items()):
+            if self.size <= budget:
+                break
+            bufid, size, count = entry
+            if count > 0:
+                continue
+            del self._entries[sounddata]
+            del self._buffers[bufid]
+            self.size -= size
+            al.alDeleteBuffers(1, ctypes.byref(al.ALuint(bufid)))
+            self.check("alDeleteBuffers")
+
+    def clear(self):
+        """Deletes all buffers, which are not queued on any source."""
+        self.evict(0)
+
+
+class _EventQueue(object):
+    """Collects the AL_SOFT_events notifications of a context.
+
+    The events are delivered by the mixer on its own thread and stored in a
+    thread-safe queue, which is drained by the SoundSink.
+    """
+    TYPES = (al.AL_EVENT_TYPE_BUFFER_COMPLETED_SOFT,
+             al.AL_EVENT_TYPE_SOURCE_STATE_CHANGED_SOFT,
+             al.AL_EVENT_TYPE_DISCONNECTED_SOFT)
+
+    def __init__(self):
+        self.events = deque()
+        # Keep a reference to the callback, as long as OpenAL may call it.
+        self._callback = al.ALEVENTPROCSOFT(self._receive)
+
+    def _receive(self, eventtype, objectid, param, length, message,
+                 userparam):
+        """Stores an event. This must not call into OpenAL."""
+        self.events.append((eventtype, objectid, param))
+
+    def enable(self):
+        """Enables the event delivery for the current context."""
+        count = len(self.TYPES)
+        al.alEventCallbackSOFT(self._callback, None)
+        al.alEventControlSOFT(count, (al.ALenum * count)(*self.TYPES),
+                              al.AL_TRUE)
 
 
 class SoundSink(object):
@@ -425,9 +920,29 @@ class SoundSink(object):
     """
     MAX_BUFFERS_PER_SOURCE = 10
     MAX_BUFFER_SIZE = 48000
-
-    def __init__(self, device=None, attributes=None):
-        """Creates a new SoundSink for a specific audio output device."""
+    BUFFER_CACHE_SIZE = 32 * 1024 * 1024
+    SOURCE_CHUNK_SIZE = 16
+    BUFFER_CHUNK_SIZE = 8
+    MAX_FREE_BUFFERS = 64
+    DEFAULT_MAX_SOURCES = 256
+    PUSH_EPSILON = 0.0
+
+    def __init__(self, device=None, attributes=None, active_only=False,
+                 max_sources=None, error_policy=None):
+        """Creates a new SoundSink for a specific audio output device.
+
+        If active_only is True, update() will only process those sources,
+        which changed properties, have sounds queued or are still playing
+        buffered data. Idle sources are skipped entirely.
+
+        max_sources limits the amount of OpenAL source ids, the SoundSink
+        uses for its SoundSource objects. If omitted, the limit reported by
+        the device is used.
+
+        error_policy controls, how often the OpenAL error state is checked
+        and can be "strict", "per-update" or "off". If omitted, the value of
+        the PYAL_ERROR_POLICY environment variable or "strict" is used.
+        """
         if isinstance(device, alc.ALCdevice):
             self.device = device
             self._deviceopened = False
@@ -444,20 +959,124 @@ class SoundSink(object):
             raise OpenALError(alc=True)
         self.context = context.contents
 
+        if error_policy is None:
+            error_policy = os.environ.get("PYAL_ERROR_POLICY", "strict")
+        self._operations = deque(maxlen=32)
+        self.error_policy = error_policy
         self._sources = {}
         self._sids = {}
-        self._streams = {}
+        # Allocated, but currently unused source ids.
+        self._freesids = deque()
+        if max_sources is None:
+            max_sources = self._get_device_sources()
+        self.max_sources = max_sources
+        self._pools = {}
+        # The amount of source ids used by the SourcePool objects.
+        self._poolsids = 0
         self._listener = None
+        self.buffercache = BufferCache(self.BUFFER_CACHE_SIZE)
+        self.buffercache.check = self._check
+        # Unused buffers, which can be filled with new data.
+        self._freebufs = []
+        # Sources, which need to be processed on the next update() call.
+        self._active = set()
+        # Sources, which got buffers queued on their current source id.
+        # Others did not play anything yet and keep their id, even if
+        # OpenAL reports them as stopped.
+        self._fedsources = set()
+        self.active_only = active_only
+        # Commands to be executed on the next update() call.
+        self._commands = deque()
+        self._feeder = None
+        self._feederstop = None
+        self._feedererror = None
+        # asyncio futures waiting for sources to stop.
+        self._waiters = {}
+        # Preallocated result array of snapshot(), grown on demand.
+        self._snapshot = None
+        # Nesting depth of begin_frame() calls and whether the context
+        # supports AL_SOFT_deferred_updates (checked on the first frame).
+        self._framedepth = 0
+        self._deferupdates = None
+        # The last values sent to OpenAL for each source id and the
+        # listener, to skip pushing unchanged values.
+        self._shadow = {}
+        self._listenershadow = {}
+        self.pushes = 0
+        self.skipped_pushes = 0
+        # The AL_SOFT_events queue, False, if the source states have to be
+        # polled, or None, if not checked yet.
+        self._eventqueue = None
+        # Indicates, that the asyncio waiters have to be checked.
+        self._checkwaiters = False
 
     def __del__(self):
+        if getattr(self, "_feeder", None) is not None:
+            self._feederstop.set()
         context = getattr(self, "context", None)
         if context:
+            if getattr(self, "_pools", None) is not None:
+                self._delete_source_ids()
             alc.alcDestroyContext(context)
         self.context = None
-        if self._deviceopened:
-            alc.alcCloseDevice(self.device)
+        # The attributes are missing, if __init__() failed early, e.g. on
+        # invalid LoopbackSoundSink arguments.
+        device = getattr(self, "device", None)
+        if device and getattr(self, "_deviceopened", False):
+            alc.alcCloseDevice(device)
         self.device = None
 
+    @property
+    def error_policy(self):
+        """Gets or sets, how often the OpenAL error state is checked.
+
+        "strict" checks it after each operation, "per-update" once at the
+        end of update(), recording the operations in between, and "off" does
+        not check it at all.
+        """
+        return self._errorpolicy
+
+    @error_policy.setter
+    def error_policy(self, value):
+        """Gets or sets, how often the OpenAL error state is checked."""
+        if value == "strict":
+            self._check = _check_error
+        elif value == "per-update":
+            self._check = self._operations.append
+        elif value == "off":
+            self._check = _ignore_error
+        else:
+            raise ValueError("invalid error policy %r" % value)
+        self._operations.clear()
+        self._errorpolicy = value
+        cache = getattr(self, "buffercache", None)
+        if cache is not None:
+            cache.check = self._check
+
+    def _check_ids(self, operation, ids):
+        """Raises an OpenALError, if the allocating operation did not create
+        all ids.
+
+        This is done regardless of the error policy, so that invalid ids
+        never get into the source and buffer pools.
+        """
+        self._check(operation)
+        if not all(ids):
+            raise OpenALError("%s: %s" % (operation,
+                                          _get_error_message(al.alGetError())))
+
+    def _check_update(self):
+        """Raises an OpenALError, if an operation of the last update set an
+        error flag."""
+        operations = list(self._operations)
+        self._operations.clear()
+        err = al.alGetError()
+        if err != al.AL_NO_ERROR:
+            msg = _get_error_message(err)
+            if operations:
+                msg = "%s (after %s)" % (msg, ", ".join(operations))
+            raise OpenALError(msg)
+
     def activate(self):
         """Marks the SoundSink as being the current one for operating on
         the OpenAL states."""
@@ -481,32 +1100,157 @@ class SoundSink(object):
         """Gets, whether the SoundSink initially opened the device."""
         return self._deviceopened
 
+    @property
+    def frequency(self):
+        """Gets the mixing frequency of the device in Hz."""
+        value = alc.ALCint()
+        alc.alcGetIntegerv(self.device, alc.ALC_FREQUENCY, 1,
+                           ctypes.byref(value))
+        return value.value
+
     def refresh(self, source):
         """Refreshes the passed SoundSource's internal state."""
         sid = self._sources.get(source, None)
         if sid is None:
             raise ValueError("source not associated with the SoundSink")
-        for key in _SOURCECALLBACKS:
-            source.dataproperties[key] = _to_python(_get_source_value(sid, key))
+        for key, getter in _SOURCEGETTERS.items():
+            source.dataproperties[key] = getter(sid)
+
+    def snapshot(self, sources=None, properties=None):
+        """Reads the current state of multiple sources at once.
+
+        Returns a structured numpy array with one row per source, holding
+        the OpenAL source id (sid), state, sec_offset, buffers_queued,
+        buffers_processed, position and gain. If sources is omitted, all
+        sources bound to the SoundSink are read, in the order they were
+        bound. If properties is passed, only those fields are read and the
+        others are set to zero. Sources without an OpenAL source id get a
+        sid of 0 and zero values.
+
+        The returned array is reused by the next snapshot() call and has to
+        be copied, if it should be kept.
+        """
+        if numpy is None:
+            raise RuntimeError("snapshot() requires numpy")
+        if sources is None:
+            sources = list(self._sources)
+        if properties is None:
+            fields = _SNAPSHOTFIELDS
+        else:
+            names = set(properties)
+            fields = tuple(f for f in _SNAPSHOTFIELDS if f[0] in names)
+            unknown = names.difference(f[0] for f in fields)
+            if unknown:
+                raise ValueError("invalid snapshot properties: %s" %
+                                 ", ".join(sorted(unknown)))
+        count = len(sources)
+        result = self._snapshot
+        if result is None or len(result) < count:
+            dtype = [("sid", "u4")]
+            dtype.extend((name, vtype, shape)
+                         for name, prop, vtype, shape in _SNAPSHOTFIELDS)
+            result = self._snapshot = numpy.zeros(max(count, 16), dtype=dtype)
+        result = result[:count]
+        result.fill(0)
+        getters = _SOURCEGETTERS
+        bound = self._sources
+        for index, source in enumerate(sources):
+            sid = bound.get(source, None)
+            if sid is None:
+                continue
+            row = result[index]
+            row["sid"] = sid
+            for name, prop, vtype, shape in fields:
+                row[name] = getters[prop](sid)
+        return result
+
+    def _get_device_sources(self):
+        """Gets the maximum amount of sources supported by the device."""
+        total = 0
+        value = alc.ALCint()
+        for prop in (alc.ALC_MONO_SOURCES, alc.ALC_STEREO_SOURCES):
+            alc.alcGetIntegerv(self.device, prop, 1, ctypes.byref(value))
+            total += value.value
+        if total <= 0:
+            return self.DEFAULT_MAX_SOURCES
+        return total
+
+    def _allocate_source_ids(self):
+        """Creates a chunk of new OpenAL source ids with a single
+        alGenSources() call. Returns False, if max_sources is reached."""
+        count = min(self.SOURCE_CHUNK_SIZE,
+                    self.max_sources - len(self._sids) - self._poolsids)
+        if count <= 0:
+            return False
+        sids = (al.ALuint * count)()
+        al.alGenSources(count, sids)
+        self._check_ids("alGenSources", sids)
+        for sid in sids:
+            self._sids[sid] = None
+            self._shadow[sid] = dict(_SOURCESHADOW)
+        self._freesids.extend(sids)
+        return True
+
+    def _steal_source_id(self, source):
+        """Releases the source id of the SoundSource with the lowest
+        priority, if it does not exceed the priority of the passed
+        source.
+
+        This scans all bound sources, but is only required, once all
+        max_sources ids are in use.
+        """
+        victim = min(self._sources, key=lambda s: s.priority, default=None)
+        if victim is None or victim.priority > source.priority:
+            raise OpenALError("no free source available")
+        del victim.bufferqueue[:]
+        self._release_source_id(victim)
 
     def _create_source_id(self, source):
         """Creates a OpenAL source id for the passed SoundSource."""
         if source in self._sources:
             # We should have a OpenAL source id already
             return self._sources[source]
-        # None yet, create a new one or bind it to an existing id
-        sid = None
-        for p, v in self._sids.items():
-            if v is None:
-                # Unused sid, use that one
-                sid = p
-        if not sid:
-            sid = al.ALuint()
-            al.alGenSources(1, sid)
-            _continue_or_raise()
-        self._sources[source] = sid.value
-        self._sids[sid.value] = source
-        return sid.value
+        # None yet, take an unused one from the pool.
+        if not self._freesids and not self._allocate_source_ids():
+            self._steal_source_id(source)
+        sid = self._freesids.popleft()
+        self._sources[source] = sid
+        self._sids[sid] = source
+        # The id does not know anything about the source yet, push all of
+        # its properties.
+        with _changelock:
+            changed = source.changedproperties
+            for prop in source.dataproperties:
+                if prop in _SOURCEDEFAULTS and prop not in changed:
+                    changed.append(prop)
+        if not any(a is self._active for a in source._activesets):
+            source._activesets.append(self._active)
+        self._active.add(source)
+        return sid
+
+    def _release_source_id(self, source):
+        """Stops the passed SoundSource and hands its OpenAL source id back
+        to the pool."""
+        sid = self._sources.pop(source)
+        self._fedsources.discard(source)
+        al.alSourceStop(sid)
+        self._check("alSourceStop")
+        self._unqueue_buffers(sid)
+        # Restore the properties changed by the source, so that the next
+        # user of the id starts with a clean state.
+        self._push_source_values(sid, [prop for prop in source.dataproperties
+                                       if prop in _SOURCEDEFAULTS],
+                                 _SOURCEDEFAULTS)
+        self._sids[sid] = None
+        self._freesids.append(sid)
+        self._unbind_source(source)
+
+    def _unbind_source(self, source):
+        """Removes the active source set of the SoundSink from the passed
+        SoundSource, so that the source does not keep it alive."""
+        source._activesets[:] = [activeset for activeset in source._activesets
+                                 if activeset is not self._active]
+        self._active.discard(source)
 
     def play(self, sources):
         """Starts playing the buffered sounds of the source or sources."""
@@ -515,21 +1259,32 @@ class SoundSink(object):
             for source in sources:
                 sid = self._create_source_id(source)
                 sids.append(sid)
-            al.alSourcePlayv(_to_ctypes(sids, al.ALuint), len(sids))
+            al.alSourcePlayv(len(sids), _to_ctypes(sids, al.ALuint))
+            self._check("alSourcePlayv")
         else:
             sid = self._create_source_id(sources)
             al.alSourcePlay(sid)
-        _continue_or_raise()
+            self._check("alSourcePlay")
 
     def stop(self, sources):
-        """Stops playing the buffered sounds of the source or sources."""
+        """Stops playing the buffered sounds of the source or sources.
+
+        Sounds, which are still pending in the buffer queue of a source, are
+        discarded.
+        """
         if isinstance(sources, Iterable):
+            sources = list(sources)
             sids = [self._sources[source] for source in sources
                     if source in self._sources]
-            al.alSourceStopv(_to_ctypes(sids, al.ALuint), len(sids))
-        elif sources in self._sources:
-            al.alSourceStop(self._sources[sources])
-        _continue_or_raise()
+            al.alSourceStopv(len(sids), _to_ctypes(sids, al.ALuint))
+            self._check("alSourceStopv")
+        else:
+            if sources in self._sources:
+                al.alSourceStop(self._sources[sources])
+                self._check("alSourceStop")
+            sources = (sources,)
+        for source in sources:
+            del source.bufferqueue[:]
 
     def pause(self, sources):
         """Pauses the playback of the buffered sounds of the source or
@@ -537,91 +1292,647 @@ class SoundSink(object):
         if isinstance(sources, Iterable):
             sids = [self._sources[source] for source in sources
                     if source in self._sources]
-            al.alSourcePausev(_to_ctypes(sids, al.ALuint), len(sids))
+            al.alSourcePausev(len(sids), _to_ctypes(sids, al.ALuint))
+            self._check("alSourcePausev")
         elif sources in self._sources:
             al.alSourcePause(self._sources[sources])
-        _continue_or_raise()
+            self._check("alSourcePause")
 
     def rewind(self, sources):
         """Rewinds the buffers of the source or sources."""
         if isinstance(sources, Iterable):
             sids = [self._sources[source] for source in sources
                     if source in self._sources]
-            al.alSourceRewindv(_to_ctypes(sids, al.ALuint), len(sids))
+            al.alSourceRewindv(len(sids), _to_ctypes(sids, al.ALuint))
+            self._check("alSourceRewindv")
         elif sources in self._sources:
             al.alSourceRewind(self._sources[sources])
-        _continue_or_raise()
+            self._check("alSourceRewind")
 
     def process_source(self, source):
         """Processes the passed SoundSource."""
         sid = self._create_source_id(source)
         # Apply the changed information of the source, if any
-        props = getattr(source, "changedproperties", [])
+        # Swap the list first, so that properties changed by another thread
+        # in the meantime are kept for the next update.
+        with _changelock:
+            props = source.changedproperties
+            source.changedproperties = []
+        if props:
+            self._push_source_values(sid, props, source.dataproperties)
+
+        queued = self._process_buffers(sid, source.bufferqueue)
+        if queued == 0:
+            if not source.bufferqueue and source in self._fedsources:
+                state = al.ALint()
+                al.alGetSourcei(sid, al.AL_SOURCE_STATE, ctypes.byref(state))
+                if state.value == al.AL_STOPPED:
+                    # The playback finished, the id can be used by other
+                    # sources.
+                    self._release_source_id(source)
+            # Nothing left to do for the source, until it changes again.
+            # Check again after the removal, in case another thread changed
+            # the source meanwhile.
+            self._active.discard(source)
+            if source.bufferqueue or source.changedproperties:
+                self._active.add(source)
+            return
+        self._fedsources.add(source)
+        if self._eventqueue:
+            # The buffer and state events of the source will mark it as
+            # active again, no need to poll it.
+            self._active.discard(source)
+            if source.changedproperties:
+                self._active.add(source)
+
+    def _push_source_values(self, sid, props, values):
+        """Sends the passed properties to the OpenAL source id, skipping
+        those, which equal the last values sent within PUSH_EPSILON."""
+        shadow = self._shadow[sid]
+        setters = _SOURCESETTERS
+        epsilon = self.PUSH_EPSILON
+        skipped = 0
         for prop in props:
-            _set_source_value(sid, prop, source.dataproperties[prop])
-        source.changedproperties = []
-
-        # Check the OpenAL buffers for the sid
-        bufcount = al.ALint()
-        freebufs = []
-        al.alGetSourcei(sid, al.AL_BUFFERS_PROCESSED, ctypes.byref(bufcount))
-        bufcount = bufcount.value
-        while bufcount > 0:
-            bufid = al.ALuint()
-            al.alSourceUnqueueBuffers(sid, 1, ctypes.byref(bufid))
-            freebufs.append(bufid)
-            bufcount -= 1
+            value = values[prop]
+            if prop in shadow:
+                # Only the state set by the application is cached, values
+                # changed by the playback, such as offsets, are always sent.
+                if _same_value(shadow[prop], value, epsilon):
+                    skipped += 1
+                    continue
+                shadow[prop] = _shadow_value(value)
+            setters[prop](sid, value)
+        self.pushes += len(props) - skipped
+        self.skipped_pushes += skipped
+
+    def _process_buffers(self, sid, bufferqueue):
+        """Moves the SoundData objects of the passed bufferqueue into the
+        OpenAL buffer queue of the sid and returns the amount of buffers
+        queued on the sid afterwards."""
+        cache = self.buffercache
+        freebufs = self._freebufs
+        self._unqueue_buffers(sid)
 
         queued = al.ALint()
         al.alGetSourcei(sid, al.AL_BUFFERS_QUEUED, ctypes.byref(queued))
-        _continue_or_raise()
+        self._check("alGetSourcei")
         queued = queued.value
 
         # Check the source's buffer queue
-        while queued < self.MAX_BUFFERS_PER_SOURCE:
-            if len(source.bufferqueue) == 0:
-                break
-            data = source.bufferqueue.pop(0)
-            if len(freebufs) > 0:
-                bufid = freebufs.pop()
-            else:
-                bufid = al.ALuint()
-                al.alGenBuffers(1, ctypes.byref(bufid))
-                _continue_or_raise()
-
-            if getattr(data, "streaming", False):
-                # A stream that has to be read into a ring buffer
-                sids = self._streams.get(data, {})
-                offset, size = sids.get(sid)
-                bufsize = min(self.MAX_BUFFER_SIZE, size - offset)
-                bufdata = data.read(bufsize)
-                source.bufferqueue.insert(data)
+        bufids = []
+        while queued < self.MAX_BUFFERS_PER_SOURCE and bufferqueue:
+            data = bufferqueue.pop(0)
+            streaming = getattr(data, "streaming", False)
+            if streaming:
+                # A stream, which is decoded block-wise into the buffers.
+                # It stays at the front of the queue, until it is exhausted.
+                bufdata = data.read(self.MAX_BUFFER_SIZE)
+                bufsize = memoryview(bufdata).nbytes
+                if bufsize == 0:
+                    data.close()
+                    continue
+                bufferqueue.insert(0, data)
+                bufid = None
             else:
-                # A simple sound object - do not stream it.
+                # A simple sound object - do not stream it, but reuse the
+                # buffer, if it was uploaded before.
                 bufdata = data.data
                 bufsize = data.size
-            # Queue the complete data.
+                bufid = cache.acquire(data)
+
+            if bufid is None:
+                if data.format is None:
+                    data.format = get_buffer_format(data.channels,
+                                                    data.bitrate)
+                    if data.format is None:
+                        logger.error("skipping sound with unsupported "
+                                     "format: %r channels, %r bits",
+                                     data.channels, data.bitrate)
+                        if streaming:
+                            bufferqueue.pop(0)
+                            data.close()
+                        continue
+                if len(freebufs) == 0:
+                    self._allocate_buffers()
+                bufid = freebufs.pop()
+                # Upload the complete data.
+                al.alBufferData(bufid, data.format,
+                                _get_buffer_pointer(bufdata), bufsize,
+                                data.frequency)
+                self._check("alBufferData")
+                if not streaming:
+                    cache.add(data, bufid, bufsize)
+            bufids.append(bufid)
+            queued += 1
+
+        if bufids:
+            count = len(bufids)
+            al.alSourceQueueBuffers(sid, count, (al.ALuint * count)(*bufids))
+            self._check("alSourceQueueBuffers")
+            # (Re)start the playback, if the source is not playing anymore,
+            # e.g. due to a buffer underrun of a stream.
             state = al.ALint()
             al.alGetSourcei(sid, al.AL_SOURCE_STATE, ctypes.byref(state))
-            if state not in (al.AL_PAUSED, al.AL_PLAYING):
-                al.alBufferData(bufid, data.format, bufdata, bufsize,
-                                data.frequency)
-                _continue_or_raise()
-                al.alSourceQueueBuffers(sid, 1, bufid)
-                _continue_or_raise()
+            if state.value not in (al.AL_PAUSED, al.AL_PLAYING):
                 al.alSourcePlay(sid)
-            queued += 1
+                self._check("alSourcePlay")
+        return queued
+
+    def _allocate_buffers(self):
+        """Creates a chunk of new OpenAL buffers with a single
+        alGenBuffers() call and adds them to the free buffer pool."""
+        count = self.BUFFER_CHUNK_SIZE
+        bufids = (al.ALuint * count)()
+        al.alGenBuffers(count, bufids)
+        self._check_ids("alGenBuffers", bufids)
+        self._freebufs.extend(bufids)
+
+    def _unqueue_buffers(self, sid):
+        """Unqueues all processed buffers of the sid at once and moves those,
+        which do not belong to the buffer cache, into the free buffer
+        pool."""
+        bufcount = al.ALint()
+        al.alGetSourcei(sid, al.AL_BUFFERS_PROCESSED, ctypes.byref(bufcount))
+        count = bufcount.value
+        if count <= 0:
+            return
+        bufids = (al.ALuint * count)()
+        al.alSourceUnqueueBuffers(sid, count, bufids)
+        self._check("alSourceUnqueueBuffers")
+        release = self.buffercache.release
+        freebufs = self._freebufs
+        for bufid in bufids:
+            if not release(bufid):
+                freebufs.append(bufid)
+        excess = len(freebufs) - self.MAX_FREE_BUFFERS
+        if excess > 0:
+            # Keep the pool bounded, e.g. after many streams finished.
+            delbufs = (al.ALuint * excess)(*freebufs[-excess:])
+            del freebufs[-excess:]
+            al.alDeleteBuffers(excess, delbufs)
+            self._check("alDeleteBuffers")
+
+    def _create_pool_ids(self, pool):
+        """Creates the OpenAL source ids for the passed SourcePool."""
+        sids = self._pools.get(pool, None)
+        if sids is not None:
+            return sids
+        missing = len(self._sids) + self._poolsids + pool.count - \
+            self.max_sources
+        if missing > len(self._freesids):
+            raise OpenALError("not enough free sources for a pool of %d" %
+                              pool.count)
+        if missing > 0:
+            # Give unused ids of the SoundSource objects to the pool.
+            self._delete_free_source_ids(missing)
+        buf = (al.ALuint * pool.count)()
+        al.alGenSources(pool.count, buf)
+        self._check_ids("alGenSources", buf)
+        sids = numpy.array(buf, dtype=numpy.uint32)
+        self._pools[pool] = sids
+        self._poolsids += pool.count
+        return sids
+
+    def _delete_free_source_ids(self, count):
+        """Deletes count allocated, but unused source ids."""
+        sids = [self._freesids.pop() for i in range(count)]
+        for sid in sids:
+            del self._sids[sid]
+            del self._shadow[sid]
+        al.alDeleteSources(count, _to_ctypes(sids, al.ALuint))
+        self._check("alDeleteSources")
+
+    def _delete_source_ids(self):
+        """Deletes the source ids of all SoundSource and SourcePool objects
+        and the buffers of the SoundSink before the context is destroyed."""
+        current = alc.alcGetCurrentContext()
+        alc.alcMakeContextCurrent(self.context)
+        sids = list(self._sids)
+        for poolsids in self._pools.values():
+            sids.extend(poolsids.tolist())
+        if sids:
+            sidarray = _to_ctypes(sids, al.ALuint)
+            # Stopping the sources marks all of their queued buffers as
+            # processed, so that they can be unqueued and deleted.
+            al.alSourceStopv(len(sids), sidarray)
+            for sid in sids:
+                self._unqueue_buffers(sid)
+            al.alDeleteSources(len(sids), sidarray)
+        freebufs = self._freebufs
+        if freebufs:
+            al.alDeleteBuffers(len(freebufs), _to_ctypes(freebufs, al.ALuint))
+            del freebufs[:]
+        self.buffercache.clear()
+        for source in self._sources:
+            self._unbind_source(source)
+        self._sources.clear()
+        self._fedsources.clear()
+        self._sids.clear()
+        self._shadow.clear()
+        self._freesids.clear()
+        self._pools.clear()
+        self._poolsids = 0
+        # The context must not be current, while it is destroyed.
+        if current and ctypes.addressof(current.contents) != \
+                ctypes.addressof(self.context):
+            alc.alcMakeContextCurrent(current)
+        else:
+            alc.alcMakeContextCurrent(None)
+
+    def _pool_ids(self, pool, indices):
+        """Gets the OpenAL source ids of the SourcePool at the indices as
+        ctypes-compatible array."""
+        sids = self._create_pool_ids(pool)
+        if indices is not None:
+            sids = numpy.ascontiguousarray(sids[indices])
+        return sids.ctypes.data_as(ctypes.POINTER(al.ALuint)), len(sids)
+
+    def play_pool(self, pool, indices=None):
+        """Starts playing the buffered sounds of the SourcePool sources at
+        the indices or of all sources, if indices is None."""
+        self.process_pool(pool)
+        sids, count = self._pool_ids(pool, indices)
+        al.alSourcePlayv(count, sids)
+        self._check("alSourcePlayv")
+
+    def stop_pool(self, pool, indices=None):
+        """Stops playing the buffered sounds of the SourcePool sources at
+        the indices or of all sources, if indices is None."""
+        sids, count = self._pool_ids(pool, indices)
+        al.alSourceStopv(count, sids)
+        self._check("alSourceStopv")
+
+    def process_pool(self, pool):
+        """Processes the passed SourcePool.
+
+        The changed properties of all sources are determined at once via the
+        dirty bitmask and pushed to OpenAL afterwards.
+        """
+        sids = self._create_pool_ids(pool)
+        dirty = pool.dirty
+        indices = numpy.flatnonzero(dirty)
+        if len(indices) != 0:
+            flags = dirty[indices]
+            for name, flag, prop, size in pool._PROPERTIES:
+                changed = indices[(flags & flag) != 0]
+                if len(changed) == 0:
+                    continue
+                values = getattr(pool, name)[changed].tolist()
+                if size == 3:
+                    setter = al.alSource3f
+                    for sid, (x, y, z) in zip(sids[changed].tolist(), values):
+                        setter(sid, prop, x, y, z)
+                    self._check("alSource3f")
+                else:
+                    setter = al.alSourcef
+                    for sid, value in zip(sids[changed].tolist(), values):
+                        setter(sid, prop, value)
+                    self._check("alSourcef")
+            dirty[indices] = 0
+
+        for index in list(pool._active):
+            bufferqueue = pool.bufferqueues[index]
+            queued = self._process_buffers(int(sids[index]), bufferqueue)
+            if queued == 0:
+                pool._active.discard(index)
+                if bufferqueue:
+                    pool._active.add(index)
 
     def process_listener(self):
         """Processes the SoundListener attached to the SoundSink."""
-        props = getattr(self.listener, "changedproperties", [])
+        listener = self.listener
+        with _changelock:
+            props = listener.changedproperties
+            listener.changedproperties = []
+        shadow = self._listenershadow
+        setters = _LISTENERSETTERS
+        values = listener.dataproperties
+        epsilon = self.PUSH_EPSILON
+        skipped = 0
         for prop in props:
-            _set_listener_value(prop, self.listener.dataproperties[prop])
-        self.listener.changedproperties = []
+            value = values[prop]
+            last = shadow.get(prop, None)
+            if last is not None and _same_value(last, value, epsilon):
+                skipped += 1
+                continue
+            shadow[prop] = _shadow_value(value)
+            setters[prop](value)
+        self.pushes += len(props) - skipped
+        self.skipped_pushes += skipped
+
+    def post(self, func, *args):
+        """Schedules func(*args) to be executed on the next update() call.
+
+        This can be safely called from any thread. If the background feeder
+        is running, the call will be executed on the feeder thread.
+        """
+        self._commands.append((func, args))
+
+    def _run_commands(self):
+        """Executes the commands scheduled via post()."""
+        commands = self._commands
+        while commands:
+            func, args = commands.popleft()
+            func(*args)
+
+    @property
+    def feeding(self):
+        """Gets, whether the background feeder thread is running."""
+        return self._feeder is not None
+
+    def start_feeder(self, period=0.01):
+        """Starts a background thread, which calls update() every period
+        seconds.
+
+        While the feeder is running, update() must not be called from other
+        threads. Use post() to hand over operations to the feeder instead.
+        """
+        if self._feeder is not None:
+            raise RuntimeError("the feeder is already running")
+        self._feedererror = None
+        self._feederstop = threading.Event()
+        self._feeder = threading.Thread(target=self._feed,
+                                        args=(period, self._feederstop),
+                                        name="SoundSink feeder")
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def stop_feeder(self):
+        """Stops the background feeder thread.
+
+        If the feeder stopped due to an error, the error is raised.
+        """
+        if self._feeder is None:
+            return
+        self._feederstop.set()
+        self._feeder.join()
+        self._feeder = None
+        error, self._feedererror = self._feedererror, None
+        if error is not None:
+            raise error
+
+    def _bind_thread_context(self):
+        """Makes the context of the SoundSink current for the calling
+        thread.
+
+        With ALC_EXT_thread_local_context, the context is set for the thread
+        only, otherwise it is made current for the whole process. Returns
+        True, if a thread-local context was set, False otherwise.
+        """
+        threadlocal = alc.alcSetThreadContext is not None and \
+            _has_extension(b"ALC_EXT_thread_local_context", self.device)
+        if threadlocal:
+            alc.alcSetThreadContext(self.context)
+        else:
+            alc.alcMakeContextCurrent(self.context)
+        return threadlocal
+
+    def _feed(self, period, stop):
+        """The background feeder loop."""
+        threadlocal = self._bind_thread_context()
+        try:
+            while not stop.wait(period):
+                self.update()
+        except Exception as exc:
+            logger.exception("SoundSink feeder stopped")
+            self._feedererror = exc
+        finally:
+            if threadlocal:
+                alc.alcSetThreadContext(None)
+
+    async def play_async(self, source):
+        """Starts playing the buffered sounds of the source and waits, until
+        the source stopped.
+
+        The playback is started and the completion is detected by the next
+        update() calls, which have to be driven by run_async(), the feeder
+        thread or the application.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.post(self._play_waiting, source, loop, future)
+        return await future
+
+    def _play_waiting(self, source, loop, future):
+        """Starts playing the source and registers the asyncio future to be
+        resolved, once the source stopped."""
+        try:
+            self.play(source)
+        except Exception as exc:
+            loop.call_soon_threadsafe(_fail_future, future, exc)
+        else:
+            self._waiters.setdefault(source, []).append((loop, future))
+            self._checkwaiters = True
+
+    async def run_async(self, period=0.01):
+        """Calls update() every period seconds, until cancelled.
+
+        update() is executed on a dedicated worker thread, so that decoding
+        streams does not block the event loop. While run_async() is active,
+        update() must not be called from other threads.
+        """
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix="SoundSink",
+                                      initializer=self._bind_thread_context)
+        try:
+            while True:
+                await loop.run_in_executor(executor, self.update)
+                await asyncio.sleep(period)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _check_waiters(self):
+        """Resolves the asyncio futures of all sources, which stopped."""
+        state = al.ALint()
+        for source, waiters in list(self._waiters.items()):
+            if source.bufferqueue:
+                continue
+            sid = self._sources.get(source, None)
+            if sid is not None:
+                al.alGetSourcei(sid, al.AL_SOURCE_STATE, ctypes.byref(state))
+                if state.value != al.AL_STOPPED:
+                    continue
+            del self._waiters[source]
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_resolve_future, future, source)
+
+    @property
+    def event_driven(self):
+        """Indicates, whether the source states are tracked by
+        AL_SOFT_events instead of polling them."""
+        return bool(self._eventqueue)
+
+    def _enable_events(self):
+        """Enables AL_SOFT_events for the context, if it is supported."""
+        if al.alEventCallbackSOFT is not None and \
+                _has_extension(b"AL_SOFT_events"):
+            self._eventqueue = _EventQueue()
+            self._eventqueue.enable()
+        else:
+            self._eventqueue = False
+
+    def _dispatch_events(self):
+        """Marks the sources of the received events as active."""
+        events = self._eventqueue.events
+        sids = self._sids
+        while events:
+            eventtype, sid, param = events.popleft()
+            if eventtype == al.AL_EVENT_TYPE_DISCONNECTED_SOFT:
+                logger.warning("the audio device has been disconnected")
+                continue
+            source = sids.get(sid, None)
+            if source is None:
+                continue
+            if eventtype == al.AL_EVENT_TYPE_SOURCE_STATE_CHANGED_SOFT and \
+                    param == al.AL_STOPPED:
+                self._checkwaiters = True
+            self._active.add(source)
+
+    def begin_frame(self):
+        """Starts a batch of property changes.
+
+        If the context supports AL_SOFT_deferred_updates, all changes until
+        the matching end_frame() call are applied by the mixer at once.
+        Calls can be nested, only the outermost pair takes effect.
+        """
+        if self._framedepth == 0:
+            if self._deferupdates is None:
+                self._deferupdates = al.alDeferUpdatesSOFT is not None and \
+                    _has_extension(b"AL_SOFT_deferred_updates")
+            if self._deferupdates:
+                al.alDeferUpdatesSOFT()
+        self._framedepth += 1
+
+    def end_frame(self):
+        """Ends a batch of property changes started with begin_frame()."""
+        if self._framedepth == 0:
+            raise RuntimeError("end_frame() called without begin_frame()")
+        self._framedepth -= 1
+        if self._framedepth == 0 and self._deferupdates:
+            al.alProcessUpdatesSOFT()
 
     def update(self):
-        """Processes all currently attached sound sources."""
-        self.process_listener()
-        process_source = self.process_source
-        for source in self._sources:
-            process_source(source)
+        """Processes all currently attached sound sources.
+
+        If active_only is set, only those sources, which require processing,
+        are taken into account. All changes are pushed within a
+        begin_frame()/end_frame() pair, so that the mixer applies them at
+        once.
+        """
+        if self._eventqueue is None:
+            self._enable_events()
+        self.begin_frame()
+        try:
+            self._run_commands()
+            if self._eventqueue:
+                self._dispatch_events()
+            self.process_listener()
+            process_source = self.process_source
+            if self.active_only:
+                sources = list(self._active)
+            else:
+                sources = list(self._active.union(self._sources))
+            bound = self._sources
+            for source in sources:
+                if source in bound or source.bufferqueue:
+                    process_source(source)
+                else:
+                    # A source without an OpenAL source id and nothing to
+                    # play. Its properties will be pushed, once it gets an id
+                    # again.
+                    self._active.discard(source)
+                    if source.bufferqueue:
+                        self._active.add(source)
+            for pool in self._pools:
+                self.process_pool(pool)
+        finally:
+            self.end_frame()
+        if self._waiters and (self._checkwaiters or not self._eventqueue):
+            self._checkwaiters = False
+            self._check_waiters()
+        if self._errorpolicy == "per-update":
+            self._check_update()
+
+
+class LoopbackSoundSink(SoundSink):
+    """Audio rendering system without an output device.
+
+    The LoopbackSoundSink mixes its sources on request via render() instead
+    of playing them on an audio device, as fast as the CPU allows.
+    """
+    # Channel counts and sample types supported by ALC_SOFT_loopback.
+    _CHANNELS = {
+        1: alc.ALC_MONO_SOFT,
+        2: alc.ALC_STEREO_SOFT,
+        4: alc.ALC_QUAD_SOFT,
+        6: alc.ALC_5POINT1_SOFT,
+        7: alc.ALC_6POINT1_SOFT,
+        8: alc.ALC_7POINT1_SOFT,
+        }
+    _TYPES = {
+        "int8": alc.ALC_BYTE_SOFT,
+        "uint8": alc.ALC_UNSIGNED_BYTE_SOFT,
+        "int16": alc.ALC_SHORT_SOFT,
+        "uint16": alc.ALC_UNSIGNED_SHORT_SOFT,
+        "int32": alc.ALC_INT_SOFT,
+        "uint32": alc.ALC_UNSIGNED_INT_SOFT,
+        "float32": alc.ALC_FLOAT_SOFT,
+        }
+
+    def __init__(self, frequency=44100, channels=2, dtype="float32",
+                 attributes=None, **kwargs):
+        """Creates a new LoopbackSoundSink, which renders samples of the
+        passed dtype with the passed amount of channels and frequency.
+
+        The remaining arguments are passed to SoundSink.
+        """
+        if numpy is None:
+            raise RuntimeError("LoopbackSoundSink requires numpy")
+        if alc.alcLoopbackOpenDeviceSOFT is None:
+            raise OpenALError("ALC_SOFT_loopback is not supported")
+        dtype = numpy.dtype(dtype)
+        if channels not in self._CHANNELS or dtype.name not in self._TYPES:
+            raise ValueError("unsupported render format: %d channels, %s" %
+                             (channels, dtype.name))
+        device = alc.alcLoopbackOpenDeviceSOFT(None)
+        if not device:
+            raise OpenALError("could not open a loopback device")
+        device = device.contents
+        chtype = self._CHANNELS[channels]
+        sampletype = self._TYPES[dtype.name]
+        if ord(alc.alcIsRenderFormatSupportedSOFT(device, frequency, chtype,
+                                                  sampletype)) != alc.ALC_TRUE:
+            alc.alcCloseDevice(device)
+            raise ValueError("unsupported render format: %d channels, %s, "
+                             "%d Hz" % (channels, dtype.name, frequency))
+        attrs = [alc.ALC_FORMAT_CHANNELS_SOFT, chtype,
+                 alc.ALC_FORMAT_TYPE_SOFT, sampletype,
+                 alc.ALC_FREQUENCY, frequency]
+        if attributes:
+            attrs.extend(attributes)
+        attrs.append(0)
+        try:
+            super(LoopbackSoundSink, self).__init__(device, attrs, **kwargs)
+        except Exception:
+            alc.alcCloseDevice(device)
+            raise
+        # The loopback device belongs to the sink.
+        self._deviceopened = True
+        self.channels = channels
+        self.dtype = dtype
+
+    def render(self, frames, out=None):
+        """Mixes the next frames of all playing sources.
+
+        Returns a numpy array of shape (frames, channels). If out is passed,
+        the samples are written into it instead of a new array.
+        """
+        if out is None:
+            out = numpy.empty((frames, self.channels), dtype=self.dtype)
+        elif out.dtype != self.dtype or out.shape != (frames, self.channels) \
+                or not out.flags.c_contiguous:
+            raise ValueError("out must be a contiguous %s array of shape %r" %
+                             (self.dtype.name, (frames, self.channels)))
+        alc.alcRenderSamplesSOFT(self.device, out.ctypes.data, frames)
+        return out
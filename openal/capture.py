@@ -0,0 +1,230 @@
+"""OpenAL audio capture support."""
+import asyncio
+import ctypes
+import time
+from . import al, alc
+from .audio import OpenALError
+
+try:
+    import numpy  # optional
+except ImportError:
+    numpy = None
+
+__all__ = ["CaptureDevice"]
+
+
+# The numpy types of the captured samples for the bits per sample.
+_DTYPES = {8: "uint8", 16: "int16", 32: "float32"}
+
+# The capture formats for (channels, bits) pairs. The float formats of
+# AL_EXT_float32 are looked up via alcGetEnumValue(), since capturing does
+# not require a current context.
+_FORMATS = {
+    (1, 8): al.AL_FORMAT_MONO8,
+    (2, 8): al.AL_FORMAT_STEREO8,
+    (1, 16): al.AL_FORMAT_MONO16,
+    (2, 16): al.AL_FORMAT_STEREO16,
+    }
+_FLOATFORMATS = {
+    (1, 32): b"AL_FORMAT_MONO_FLOAT32",
+    (2, 32): b"AL_FORMAT_STEREO_FLOAT32",
+    }
+
+
+def _get_capture_format(channels, bitrate):
+    """Gets the OpenAL capture format for the passed amount of channels
+    and bits per sample or None, if there is none."""
+    dformat = _FORMATS.get((channels, bitrate), None)
+    if dformat is not None:
+        return dformat
+    enumname = _FLOATFORMATS.get((channels, bitrate), None)
+    if enumname is None:
+        return None
+    dformat = alc.alcGetEnumValue(None, enumname)
+    if dformat in (0, -1):
+        return None
+    _FORMATS[(channels, bitrate)] = dformat
+    return dformat
+
+
+class CaptureDevice(object):
+    """An audio input device, which records into a ring buffer.
+
+    The captured samples are copied by OpenAL straight into a preallocated
+    numpy ring buffer of ringsize frames. If the application does not read
+    them fast enough, the oldest frames are overwritten, so that the memory
+    use stays bounded.
+    """
+    # The shortest time in seconds to sleep, while waiting for samples.
+    MIN_WAIT = 0.001
+
+    def __init__(self, device=None, frequency=44100, channels=1, bitrate=16,
+                 buffersize=None, ringsize=None):
+        """Opens the passed capture device or the default one.
+
+        buffersize is the amount of frames buffered by OpenAL and defaults
+        to half a second. ringsize is the amount of frames kept in the ring
+        buffer and defaults to one second, but at least buffersize.
+        """
+        if numpy is None:
+            raise RuntimeError("CaptureDevice requires numpy")
+        dformat = _get_capture_format(channels, bitrate)
+        if dformat is None:
+            raise ValueError("unsupported capture format: %d channels, "
+                             "%d bits" % (channels, bitrate))
+        if buffersize is None:
+            buffersize = frequency // 2
+        if ringsize is None:
+            ringsize = max(frequency, buffersize)
+        if isinstance(device, str):
+            device = device.encode("utf-8")
+        self.frequency = frequency
+        self.channels = channels
+        self.bitrate = bitrate
+        self.device = alc.alcCaptureOpenDevice(device, frequency, dformat,
+                                               buffersize)
+        if not self.device:
+            self.device = None
+            raise OpenALError("could not open the capture device")
+        dtype = numpy.dtype(_DTYPES[bitrate])
+        self.ring = numpy.zeros((ringsize, channels), dtype=dtype)
+        # The block used by read() for frames wrapping around the end of the
+        # ring buffer.
+        self._block = numpy.empty((0, channels), dtype=dtype)
+        # The write position and the amount of unread frames in the ring.
+        self._head = 0
+        self._count = 0
+        self._samples = alc.ALCint()
+        self.capturing = False
+        self.dropped = 0
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """Gets the amount of unread frames in the ring buffer."""
+        return self._count
+
+    @property
+    def available(self):
+        """Gets the amount of frames captured by OpenAL, which were not
+        moved into the ring buffer yet."""
+        alc.alcGetIntegerv(self.device, alc.ALC_CAPTURE_SAMPLES, 1,
+                           ctypes.byref(self._samples))
+        return self._samples.value
+
+    def start(self):
+        """Starts capturing."""
+        alc.alcCaptureStart(self.device)
+        self.capturing = True
+
+    def stop(self):
+        """Stops capturing. Already captured frames can still be read."""
+        if self.capturing:
+            alc.alcCaptureStop(self.device)
+            self.capturing = False
+
+    def close(self):
+        """Stops capturing and closes the capture device."""
+        if getattr(self, "device", None) is None:
+            return
+        self.stop()
+        alc.alcCaptureCloseDevice(self.device)
+        self.device = None
+
+    def poll(self):
+        """Moves the captured frames from OpenAL into the ring buffer and
+        returns their amount.
+
+        If the ring buffer is full, the oldest frames are overwritten and
+        counted in dropped.
+        """
+        ring = self.ring
+        size = len(ring)
+        total = pending = self.available
+        while pending > 0:
+            # Capture straight into the ring, up to its end.
+            count = min(pending, size - self._head)
+            alc.alcCaptureSamples(self.device, ring[self._head:].ctypes.data,
+                                  count)
+            self._head = (self._head + count) % size
+            pending -= count
+        self._count += total
+        if self._count > size:
+            self.dropped += self._count - size
+            self._count = size
+        return total
+
+    def read(self, frames):
+        """Takes the next frames from the ring buffer.
+
+        Returns an array of shape (frames, channels) or None, if less frames
+        are available. The array is a view of the ring buffer, if possible,
+        and only valid until the next read() or poll() call.
+        """
+        ring = self.ring
+        size = len(ring)
+        if frames > size:
+            raise ValueError("frames must not exceed the ring size %d" % size)
+        self.poll()
+        if self._count < frames:
+            return None
+        start = (self._head - self._count) % size
+        end = start + frames
+        if end <= size:
+            block = ring[start:end]
+        else:
+            if len(self._block) < frames:
+                self._block = numpy.empty((frames, self.channels),
+                                          dtype=ring.dtype)
+            block = self._block[:frames]
+            split = size - start
+            block[:split] = ring[start:]
+            block[split:] = ring[:end - size]
+        self._count -= frames
+        return block
+
+    def _wait_time(self, frames):
+        """Gets the time in seconds, until the missing frames should be
+        captured."""
+        missing = frames - self._count - self.available
+        return max(missing / self.frequency, self.MIN_WAIT)
+
+    def frames(self, blocksize):
+        """Iterates over the captured audio in blocks of blocksize frames.
+
+        The iteration ends, once capturing was stopped and less than
+        blocksize frames are left. While waiting for new frames, the
+        thread sleeps, until enough of them should be captured.
+        """
+        while True:
+            block = self.read(blocksize)
+            if block is not None:
+                yield block
+            elif not self.capturing:
+                return
+            else:
+                time.sleep(self._wait_time(blocksize))
+
+    async def frames_async(self, blocksize):
+        """Asynchronously iterates over the captured audio in blocks of
+        blocksize frames.
+
+        Like frames(), but waits via asyncio.sleep(), so that the event loop
+        keeps running.
+        """
+        while True:
+            block = self.read(blocksize)
+            if block is not None:
+                yield block
+            elif not self.capturing:
+                return
+            else:
+                await asyncio.sleep(self._wait_time(blocksize))
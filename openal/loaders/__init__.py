@@ -1,10 +1,18 @@
 """Utility functions for loading sounds."""
+import mmap
 import os
+import struct
 import sys
+import time
 import wave
-import array
-from itertools import chain
-from ..audio import SoundData
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from ..audio import SoundData, StreamingSoundData, get_buffer_format
+from ..log import logger
+from .bank import SoundBank, build_bank, open_bank
+from .cache import PCMCache
+from .transform import downmix, resample, _downmix_samples, \
+    _resample_samples
 
 try:
     import soundfile  # optional
@@ -13,17 +21,152 @@ except ImportError:
 import numpy
 
 
-__all__ = ["load_wav_file", "load_file"]
+__all__ = ["load_wav_file", "load_file", "load_files", "load_stream",
+           "PCMCache", "SoundBank", "build_bank", "open_bank", "downmix",
+           "resample"]
 
 
-def load_wav_file(fname):
-    """Loads a WAV encoded audio file into a SoundData object."""
-    fp = wave.open(fname, "rb")
-    channels = fp.getnchannels()
-    bitrate = fp.getsampwidth() * 8
-    samplerate = fp.getframerate()
-    buf = fp.readframes(fp.getnframes())
-    return SoundData(buf, channels, bitrate, len(buf), samplerate)
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# format tag, channels, sample rate, byte rate, block align, bits per sample
+_WAVFMT = struct.Struct("<HHIIHH")
+# The supported WAV sample formats and their numpy types. 24 bit samples
+# are handled separately.
+_WAVTYPES = {
+    (_WAVE_FORMAT_PCM, 8): "u1",
+    (_WAVE_FORMAT_PCM, 16): "<i2",
+    (_WAVE_FORMAT_PCM, 24): None,
+    (_WAVE_FORMAT_PCM, 32): "<i4",
+    (_WAVE_FORMAT_IEEE_FLOAT, 32): "<f4",
+    }
+# The bits per sample of the sample types passed to SoundData.
+_BITS = {"uint8": 8, "int16": 16, "float32": 32}
+_DTYPENAMES = {bits: name for name, bits in _BITS.items()}
+
+# The sample type used by worker processes of load_files(), which can not
+# query the current context.
+_nativedtype = None
+
+
+def _set_native_dtype(dtype):
+    """Sets the sample type to be used by _native_dtype()."""
+    global _nativedtype
+    _nativedtype = dtype
+
+
+def _native_dtype():
+    """Gets the sample type preferred by the current context, float32, if
+    AL_EXT_float32 is supported, int16 otherwise."""
+    if _nativedtype is not None:
+        return _nativedtype
+    if get_buffer_format(1, 32) is not None:
+        return "float32"
+    return "int16"
+
+
+def _convert_samples(samples, dtype):
+    """Converts the samples to int16 or float32 samples."""
+    kind = samples.dtype.kind
+    if dtype == "float32":
+        if kind == "f":
+            return samples.astype(numpy.float32)
+        if kind == "u":
+            return (samples.astype(numpy.float32) - 128) / 128
+        scale = float(1 << (samples.dtype.itemsize * 8 - 1))
+        return (samples / scale).astype(numpy.float32)
+    if kind == "f":
+        return (numpy.clip(samples, -1.0, 1.0) * 32767).astype(numpy.int16)
+    if kind == "u":
+        return ((samples.astype(numpy.int16) - 128) << 8).astype(numpy.int16)
+    return (samples >> (samples.dtype.itemsize * 8 - 16)).astype(numpy.int16)
+
+
+def _parse_wav(buf):
+    """Parses the RIFF chunks of a WAV file.
+
+    Returns the format tag, channels, bits per sample, sample rate and the
+    offset and size of the PCM data.
+    """
+    if len(buf) < 12 or buf[0:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise ValueError("not a RIFF WAVE file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunkid = buf[pos:pos + 4]
+        chunksize, = struct.unpack_from("<I", buf, pos + 4)
+        start = pos + 8
+        if chunkid == b"fmt ":
+            if chunksize < _WAVFMT.size:
+                raise ValueError("invalid fmt chunk")
+            tag, channels, rate, byterate, align, bits = \
+                _WAVFMT.unpack_from(buf, start)
+            if tag == _WAVE_FORMAT_EXTENSIBLE:
+                if chunksize < 40:
+                    raise ValueError("invalid WAVE_FORMAT_EXTENSIBLE chunk")
+                # The actual format is given by the first two bytes of the
+                # sub format GUID.
+                tag, = struct.unpack_from("<H", buf, start + 24)
+            fmt = (tag, channels, bits, rate, align)
+        elif chunkid == b"data":
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            tag, channels, bits, rate, align = fmt
+            # Cut truncated files and incomplete frames.
+            size = min(chunksize, len(buf) - start)
+            if align:
+                size -= size % align
+            return tag, channels, bits, rate, start, size
+        # Chunks are padded to an even size.
+        pos = start + chunksize + (chunksize & 1)
+    raise ValueError("no data chunk found")
+
+
+def load_wav_file(fname, dtype=None):
+    """Loads a WAV encoded audio file into a SoundData object.
+
+    The file is memory-mapped and the PCM data is handed to the SoundData
+    without copying it, so that it is only read as needed and shared with
+    other processes loading the same file. fname can also be a file-like
+    object, which is read completely instead.
+
+    dtype can be "int16" or "float32" to convert the samples to that type.
+    If omitted, 8 and 16 bit samples are kept as they are and other samples
+    are converted to float32, if the current context supports it, or to
+    int16. Unsupported WAV formats raise a ValueError.
+    """
+    if dtype not in (None, "int16", "float32"):
+        raise ValueError("unsupported sample type %r" % dtype)
+    if isinstance(fname, (str, bytes, os.PathLike)):
+        with open(fname, "rb") as fp:
+            try:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("not a RIFF WAVE file")
+    else:
+        buf = fname.read()
+    tag, channels, bits, rate, offset, size = _parse_wav(buf)
+    if (tag, bits) not in _WAVTYPES:
+        raise ValueError("unsupported WAV format: format tag 0x%04x, "
+                         "%d channels, %d bits" % (tag, channels, bits))
+    data = memoryview(buf)[offset:offset + size]
+    if bits == 24:
+        # Expand the little-endian samples to 32 bit.
+        samples = numpy.zeros((size // 3, 4), dtype=numpy.uint8)
+        samples[:, 1:] = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1,
+                                                                          3)
+        samples = samples.view("<i4").ravel()
+    else:
+        samples = numpy.frombuffer(data, dtype=_WAVTYPES[(tag, bits)])
+    if dtype is None:
+        if bits <= 16:
+            dtype = samples.dtype.name
+        else:
+            dtype = _native_dtype()
+    if samples.dtype.name != dtype:
+        data = _convert_samples(samples, dtype)
+        size = data.nbytes
+    return SoundData(data, channels, _BITS[dtype], size, rate)
 
 
 # supported extensions
@@ -33,31 +176,283 @@ def load_wav_file(fname):
 # }
 
 
-def load_file(fname):
-    """Loads an audio file into a SoundData object."""
+def _format_key(dtype, mono, frequency):
+    """Gets the PCMCache format key for the passed load_file() options."""
+    fmt = dtype
+    if mono:
+        fmt += ",mono"
+    if frequency is not None:
+        fmt += ",%dHz" % frequency
+    return fmt
+
+
+def load_file(fname, cache=None, dtype=None, mono=False, frequency=None):
+    """Loads an audio file into a SoundData object.
+
+    The samples are decoded as dtype, which can be "int16" or "float32". If
+    omitted, float32 is used, if the current context supports it, or int16
+    otherwise. If mono is True, multichannel files are downmixed to mono,
+    so that they can be spatialized by OpenAL. If frequency is passed, the
+    samples are resampled to it, so that OpenAL does not need to resample
+    them on playback.
+
+    WAV files are loaded via load_wav_file(), if possible, without
+    decoding them. If a PCMCache is passed, the decoded data of other files
+    is taken from it, if possible, or stored in it otherwise.
+    """
+    ext = os.path.splitext(os.fspath(fname))[1]
+    if ext.lower() in (".wav", b".wav"):
+        try:
+            snddata = load_wav_file(fname, dtype)
+        except ValueError:
+            if not soundfile:
+                raise
+        else:
+            if frequency is None or frequency == snddata.frequency:
+                if mono:
+                    snddata = downmix(snddata, cached=False)
+                return snddata
+            # Resampling is too expensive to be repeated on each load.
+            if cache is not None:
+                fmt = _format_key(_DTYPENAMES[snddata.bitrate], mono,
+                                  frequency)
+                cached = cache.get(fname, fmt)
+                if cached is not None:
+                    return cached
+            if mono:
+                snddata = downmix(snddata, cached=False)
+            snddata = resample(snddata, frequency, cached=False)
+            if cache is not None:
+                cache.put(fname, fmt, snddata)
+            return snddata
+
+    if dtype is None:
+        dtype = _native_dtype()
+    elif dtype not in ("int16", "float32"):
+        raise ValueError("unsupported sample type %r" % dtype)
+
+    if cache is not None:
+        fmt = _format_key(dtype, mono, frequency)
+        snddata = cache.get(fname, fmt)
+        if snddata is not None:
+            return snddata
+        snddata = load_file(fname, dtype=dtype, mono=mono,
+                            frequency=frequency)
+        cache.put(fname, fmt, snddata)
+        return snddata
 
     if soundfile:
 
+        start = time.perf_counter()
         with open(fname, "rb") as f:
-            buf, samplerate = soundfile.read(f, dtype="int16")
+            buf, samplerate = soundfile.read(f, dtype=dtype)
+        decoded = time.perf_counter()
 
-        lenbuf = len(buf)
-        if buf.size == 0 or type(buf[0]) == numpy.int16:
+        # soundfile returns a (frames,) array for mono and a
+        # (frames, channels) array for multichannel data. The latter is
+        # already interleaved in C order, as OpenAL expects it.
+        if buf.ndim == 1:
             channels = 1
-        else:  # contains channels
-            channels = len(buf[0])
-            buf = tuple(chain(*buf))
-        buf = array.array("h", buf).tobytes()
-        return SoundData(buf, channels, 16, lenbuf * 2, samplerate)
+        elif mono:
+            buf = _downmix_samples(buf)
+            channels = 1
+        else:
+            channels = buf.shape[1]
+        if frequency is not None and frequency != samplerate:
+            buf = _resample_samples(buf.reshape(len(buf), channels),
+                                    samplerate, frequency)
+            samplerate = frequency
+        buf = numpy.ascontiguousarray(buf)
+        converted = time.perf_counter()
+        logger.debug("loaded %r: decoding took %.4fs, conversion took %.4fs",
+                     fname, decoded - start, converted - decoded)
+        return SoundData(buf, channels, _BITS[dtype], buf.nbytes, samplerate)
+
+    else:
+
+        raise ValueError("unsupported audio file type")
+
+
+def _load_file_or_error(fname, cache=None, dtype=None, mono=False,
+                        frequency=None, mapped=True):
+    """Loads an audio file and returns the SoundData and None or None and
+    the raised exception.
+
+    If mapped is False, None is returned instead of a SoundData with
+    memory-mapped data, e.g. of a WAV file or a cache entry, which can not
+    be sent to another process. The caller is expected to map the file
+    again, which neither copies nor decodes it.
+    """
+    try:
+        snddata = load_file(fname, cache, dtype, mono, frequency)
+    except Exception as exc:
+        return None, exc
+    if not mapped and isinstance(snddata.data, memoryview):
+        return None, None
+    return snddata, None
+
+
+def load_files(fnames, workers=None, processes=False, errors=None,
+               cache=None, dtype=None, mono=False, frequency=None):
+    """Loads multiple audio files in parallel into SoundData objects.
 
+    The files are decoded by a pool of worker threads, or processes, if
+    processes is True. If workers is omitted, one worker per CPU is used.
+    The SoundData objects are returned in the order of the passed file
+    names.
+
+    If errors is a dict, the exceptions of the files, which could not be
+    loaded, are stored in it by their file name and None is returned for
+    them. Otherwise the first error is raised, once all files were
+    processed.
+
+    cache, dtype, mono and frequency are passed to load_file(). If
+    processes are used, memory-mapped WAV files and the decoded data in the
+    cache are mapped again by the calling process, which avoids copying
+    them between the processes.
+    """
+    fnames = list(fnames)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if processes:
+        # The workers can not query the context for its preferred sample
+        # type, so pass it on.
+        executor = ProcessPoolExecutor(workers, initializer=_set_native_dtype,
+                                       initargs=(_native_dtype(),))
+        # Send the files in chunks to reduce the overhead of the inter-process
+        # communication for many short files.
+        chunksize = max(len(fnames) // (workers * 4), 1)
     else:
+        executor = ThreadPoolExecutor(workers)
+        chunksize = 1
+    start = time.perf_counter()
+    with executor:
+        # mmap-backed data of WAV files and the cache can not be sent to
+        # another process, map it in this one instead.
+        results = list(executor.map(partial(_load_file_or_error,
+                                            cache=cache, dtype=dtype,
+                                            mono=mono, frequency=frequency,
+                                            mapped=not processes),
+                                    fnames, chunksize=chunksize))
+    logger.debug("loaded %d files with %d workers in %.4fs", len(fnames),
+                 workers, time.perf_counter() - start)
+    sounds = []
+    failed = None
+    for fname, (snddata, exc) in zip(fnames, results):
+        if exc is None and snddata is None:
+            snddata, exc = _load_file_or_error(fname, cache, dtype, mono,
+                                               frequency)
+        if exc is not None:
+            if errors is not None:
+                errors[fname] = exc
+            elif failed is None:
+                failed = exc
+        sounds.append(snddata)
+    if failed is not None:
+        raise failed
+    return sounds
+
+
+class _SoundFileStream(object):
+    """Incremental int16 or float32 decoder for the formats supported by
+    soundfile.
 
-        if fname.lower().endswith(".wav"):
-            return load_wav_file(fname)
+    Blocks are decoded into a reusable array, so that the memory use stays
+    constant, regardless of the stream length.
+    """
+    def __init__(self, source, dtype="int16"):
+        self._file = soundfile.SoundFile(source)
+        self.channels = self._file.channels
+        self.dtype = dtype
+        self.samplewidth = _BITS[dtype] // 8
+        self.frequency = self._file.samplerate
+        self.frames = self._file.frames
+        self._block = None
+
+    def read(self, size=None):
+        """Decodes the next block of up to size bytes."""
+        framesize = self.channels * self.samplewidth
+        if size is None:
+            frames = -1
         else:
-            raise ValueError("unsupported audio file type")
+            frames = max(size // framesize, 1)
+            if self._block is None or len(self._block) < frames:
+                self._block = numpy.empty((frames, self.channels),
+                                          dtype=self.dtype)
+        if frames < 0:
+            return self._file.read(dtype=self.dtype, always_2d=True)
+        return self._file.read(frames, dtype=self.dtype, always_2d=True,
+                               out=self._block[:frames])
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Moves to the frame at the passed byte offset."""
+        framesize = self.channels * self.samplewidth
+        self._file.seek(offset // framesize, whence)
 
+    def tell(self):
+        """Gets the current position as byte offset."""
+        return self._file.tell() * self.channels * self.samplewidth
 
-def load_stream(source):
-    """Loads an audio stream into a SoundData object."""
-    raise NotImplementedError("not implemented yet")
+    def close(self):
+        """Closes the underlying file."""
+        self._file.close()
+
+
+class _WaveStream(object):
+    """Incremental reader for WAV encoded PCM data."""
+    def __init__(self, source):
+        self._file = wave.open(source, "rb")
+        self.channels = self._file.getnchannels()
+        self.samplewidth = self._file.getsampwidth()
+        self.frequency = self._file.getframerate()
+        self.frames = self._file.getnframes()
+
+    def read(self, size=None):
+        """Reads the next block of up to size bytes."""
+        framesize = self.channels * self.samplewidth
+        if size is None:
+            frames = self.frames
+        else:
+            frames = max(size // framesize, 1)
+        return self._file.readframes(frames)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Moves to the frame at the passed byte offset."""
+        frame = offset // (self.channels * self.samplewidth)
+        if whence == os.SEEK_CUR:
+            frame += self._file.tell()
+        elif whence == os.SEEK_END:
+            frame += self.frames
+        self._file.setpos(min(max(frame, 0), self.frames))
+
+    def tell(self):
+        """Gets the current position as byte offset."""
+        return self._file.tell() * self.channels * self.samplewidth
+
+    def close(self):
+        """Closes the underlying file."""
+        self._file.close()
+
+
+def load_stream(source, dtype=None):
+    """Loads an audio file or file-like object into a StreamingSoundData
+    object.
+
+    The audio data is decoded incrementally in blocks, while the stream is
+    played. dtype is used as for load_file(), if soundfile is available.
+    """
+    if soundfile:
+        if dtype is None:
+            dtype = _native_dtype()
+        elif dtype not in ("int16", "float32"):
+            raise ValueError("unsupported sample type %r" % dtype)
+        stream = _SoundFileStream(source, dtype)
+    else:
+        try:
+            stream = _WaveStream(source)
+        except (wave.Error, EOFError):
+            raise ValueError("unsupported audio file type")
+    bits = stream.samplewidth * 8
+    size = stream.frames * stream.channels * stream.samplewidth
+    return StreamingSoundData(stream, stream.channels, bits, size,
+                              stream.frequency)
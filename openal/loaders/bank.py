@@ -0,0 +1,155 @@
+"""Packed sound banks with raw PCM data."""
+import mmap
+import struct
+from ..audio import SoundData
+
+__all__ = ["SoundBank", "build_bank", "open_bank"]
+
+
+# magic, amount of entries, size of the index in bytes
+_HEADER = struct.Struct("<8sII")
+# name size, offset, frames, channels, bits, frequency, format
+# The format is 0, if it is resolved by the SoundSink, e.g. for float32 or
+# multichannel data.
+_ENTRY = struct.Struct("<HQQHHIi")
+_MAGIC = b"PYALBNK1"
+# The alignment of the PCM data of each entry.
+_ALIGNMENT = 64
+
+
+def _align(offset):
+    """Rounds the offset up to the next aligned position."""
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def build_bank(fname, sounds):
+    """Writes the passed sounds into a sound bank file.
+
+    sounds is a mapping or sequence of (name, sound) pairs, where sound is
+    a SoundData object or the name of an audio file to load via
+    load_file().
+    """
+    from . import load_file
+
+    if hasattr(sounds, "items"):
+        sounds = sounds.items()
+    entries = []
+    for name, snddata in sounds:
+        if not isinstance(snddata, SoundData):
+            snddata = load_file(snddata)
+        entries.append((name.encode("utf-8"), snddata,
+                        memoryview(snddata.data).cast("B")))
+
+    index = []
+    offset = _align(_HEADER.size + sum(_ENTRY.size + len(name)
+                                       for name, snddata, data in entries))
+    for name, snddata, data in entries:
+        framesize = snddata.channels * snddata.bitrate // 8
+        index.append(_ENTRY.pack(len(name), offset, data.nbytes // framesize,
+                                 snddata.channels, snddata.bitrate,
+                                 snddata.frequency, snddata.format or 0) +
+                     name)
+        offset = _align(offset + data.nbytes)
+    index = b"".join(index)
+
+    with open(fname, "wb") as fp:
+        fp.write(_HEADER.pack(_MAGIC, len(entries), len(index)))
+        fp.write(index)
+        for name, snddata, data in entries:
+            fp.seek(_align(fp.tell()))
+            fp.write(data)
+        # Pad the file, so that the last entry can be mapped completely.
+        fp.truncate(_align(fp.tell()))
+
+
+class SoundBank(object):
+    """A memory-mapped sound bank file.
+
+    The sounds are looked up by their names and handed out as SoundData
+    objects, which refer to the mapped file without copying it. The same
+    SoundData object is returned for repeated lookups of a name.
+    """
+    def __init__(self, fname):
+        with open(fname, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, indexsize = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError("%r is not a sound bank" % fname)
+        self.fname = fname
+        self._index = {}
+        self._sounds = {}
+        pos = _HEADER.size
+        try:
+            for i in range(count):
+                entry = _ENTRY.unpack_from(self._map, pos)
+                pos += _ENTRY.size
+                name = bytes(self._map[pos:pos + entry[0]]).decode("utf-8")
+                pos += entry[0]
+                self._index[name] = entry[1:]
+        except struct.error:
+            self._map.close()
+            raise ValueError("%r has a truncated index" % fname)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        snddata = self._sounds.get(name, None)
+        if snddata is None:
+            offset, frames, channels, bits, frequency, dformat = \
+                self._index[name]
+            size = frames * channels * bits // 8
+            if offset + size > len(self._map):
+                # Never hand out less data than the size passed to OpenAL.
+                raise ValueError("sound %r exceeds the bank file %r" %
+                                 (name, self.fname))
+            data = memoryview(self._map)[offset:offset + size]
+            snddata = SoundData(data, channels, bits, size, frequency,
+                                dformat or None)
+            self._sounds[name] = snddata
+        return snddata
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, name, default=None):
+        """Gets the SoundData of the passed name or default, if the bank
+        does not contain it."""
+        if name not in self._index:
+            return default
+        return self[name]
+
+    def names(self):
+        """Gets the names of all sounds in the bank."""
+        return list(self._index)
+
+    def close(self):
+        """Releases the handed out SoundData objects and unmaps the file.
+
+        The SoundData objects must not be used anymore afterwards. If other
+        objects still refer to their data, e.g. numpy arrays created from
+        it, a BufferError is raised and the file stays mapped.
+        """
+        for name in list(self._sounds):
+            try:
+                self._sounds[name].data.release()
+            except BufferError:
+                # Still exported, close() can be retried later.
+                continue
+            del self._sounds[name]
+        self._map.close()
+
+
+def open_bank(fname):
+    """Opens a sound bank file created by build_bank()."""
+    return SoundBank(fname)
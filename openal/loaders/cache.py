@@ -0,0 +1,191 @@
+"""Persistent cache for decoded PCM data."""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from ..audio import SoundData
+from ..log import logger
+
+__all__ = ["PCMCache"]
+
+
+# magic, channels, bits, frequency, format, data size, crc32 of the data
+# The format is 0, if it is resolved by the SoundSink, e.g. for float32 or
+# multichannel data.
+_HEADER = struct.Struct("<8sHHIiQI")
+_MAGIC = b"PYALPCM1"
+# The PCM data starts at an aligned offset after the header.
+_DATAOFFSET = 64
+
+
+class PCMCache(object):
+    """A directory, which keeps decoded audio files as raw PCM data.
+
+    Each entry is keyed by the absolute path, size and modification time of
+    the audio file and the requested output format, so that changed files
+    are decoded again. Entries are loaded back via mmap without copying
+    them. If the cache grows beyond max_size bytes, the least recently used
+    entries are removed.
+
+    The total size is counted from the directory contents once and kept up
+    to date on storing and removing entries, so that the directory is only
+    scanned again, if max_size is exceeded. Entries stored by other
+    processes are accounted on that scan.
+    """
+    def __init__(self, directory, max_size=256 * 1024 * 1024, verify=True):
+        """Creates a new PCMCache for the passed directory.
+
+        If verify is True, the checksum of each entry is validated, when
+        it is loaded for the first time.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.verify = verify
+        # The entries, which passed the checksum validation, by their path,
+        # inode and size. Entries are replaced atomically, so that a new
+        # file gets a new inode.
+        self._verified = set()
+        # The total size of the entries or None, if the directory was not
+        # scanned yet.
+        self._total = None
+
+    def _entry(self, fname, fmt):
+        """Gets the cache file name for the passed audio file and output
+        format."""
+        stat = os.stat(fname)
+        key = "%s\0%d\0%d\0%s" % (os.path.abspath(fname), stat.st_size,
+                                  stat.st_mtime_ns, fmt)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pcm")
+
+    def _discard(self, entry, reason):
+        """Removes a broken cache entry."""
+        logger.warning("discarding cache entry %r: %s", entry, reason)
+        try:
+            size = os.stat(entry).st_size
+            os.remove(entry)
+        except OSError:
+            return
+        if self._total is not None:
+            self._total -= size
+
+    def get(self, fname, fmt):
+        """Gets the cached SoundData of the audio file in the requested
+        output format or None, if it is not cached."""
+        entry = self._entry(fname, fmt)
+        try:
+            fp = open(entry, "rb")
+        except OSError:
+            return None
+        with fp:
+            stat = os.fstat(fp.fileno())
+            try:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._discard(entry, "empty file")
+                return None
+        if len(buf) < _DATAOFFSET:
+            self._discard(entry, "truncated header")
+            return None
+        magic, channels, bits, frequency, dformat, size, crc = \
+            _HEADER.unpack_from(buf)
+        if magic != _MAGIC or len(buf) != _DATAOFFSET + size:
+            self._discard(entry, "invalid header")
+            return None
+        data = memoryview(buf)[_DATAOFFSET:]
+        key = (entry, stat.st_ino, stat.st_size)
+        if self.verify and key not in self._verified:
+            if zlib.crc32(data) != crc:
+                data.release()
+                self._discard(entry, "checksum mismatch")
+                return None
+            self._verified.add(key)
+        try:
+            # Mark the entry as recently used.
+            os.utime(entry)
+        except OSError:
+            pass
+        return SoundData(data, channels, bits, size, frequency,
+                         dformat or None)
+
+    def put(self, fname, fmt, snddata):
+        """Stores the decoded SoundData of the audio file in the requested
+        output format."""
+        entry = self._entry(fname, fmt)
+        data = memoryview(snddata.data).cast("B")
+        header = _HEADER.pack(_MAGIC, snddata.channels, snddata.bitrate,
+                              snddata.frequency, snddata.format or 0,
+                              data.nbytes, zlib.crc32(data))
+        try:
+            # The size of the entry replaced by the new one, if any.
+            oldsize = os.stat(entry).st_size
+        except OSError:
+            oldsize = 0
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(header.ljust(_DATAOFFSET, b"\0"))
+                fp.write(data)
+            # Replace atomically, so that concurrent readers never see a
+            # partially written entry.
+            os.replace(tmpname, entry)
+        except BaseException:
+            os.remove(tmpname)
+            raise
+        if self._total is None:
+            self.evict()
+            return
+        self._total += _DATAOFFSET + data.nbytes - oldsize
+        if self._total > self.max_size:
+            self.evict()
+
+    @property
+    def size(self):
+        """Gets the total size of all cache entries in bytes."""
+        total = 0
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".pcm"):
+                try:
+                    total += e.stat().st_size
+                except FileNotFoundError:
+                    # Removed by another process meanwhile.
+                    continue
+        self._total = total
+        return total
+
+    def evict(self, max_size=None):
+        """Removes the least recently used entries, until the cache does not
+        exceed max_size bytes. If max_size is omitted, the max_size of the
+        cache is used."""
+        if max_size is None:
+            max_size = self.max_size
+        entries = []
+        total = 0
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".pcm"):
+                try:
+                    stat = e.stat()
+                except FileNotFoundError:
+                    # Removed by another process meanwhile.
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, e.path))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped on some platforms, retry on the next
+                # eviction.
+                continue
+            total -= size
+        self._total = total
+
+    def clear(self):
+        """Removes all cache entries."""
+        self.evict(0)
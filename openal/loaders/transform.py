@@ -0,0 +1,142 @@
+"""Transformations of SoundData objects."""
+import math
+import weakref
+from ..audio import SoundData
+import numpy
+
+__all__ = ["downmix", "resample"]
+
+
+# The numpy types of the samples for the bits per sample.
+_DTYPES = {8: numpy.uint8, 16: numpy.int16, 32: numpy.float32}
+
+# The mono versions of the SoundData objects passed to downmix().
+_monocache = weakref.WeakKeyDictionary()
+
+# The resampled versions of the SoundData objects passed to resample(),
+# stored by their frequency.
+_ratecache = weakref.WeakKeyDictionary()
+
+# The amount of zero crossings of the interpolation filter on each side.
+_ZEROCROSSINGS = 16
+
+
+def _get_samples(snddata):
+    """Gets the samples of the SoundData as (frames, channels) array
+    without copying them."""
+    dtype = _DTYPES.get(snddata.bitrate, None)
+    if dtype is None:
+        raise ValueError("unsupported bitrate %r" % snddata.bitrate)
+    count = snddata.size // numpy.dtype(dtype).itemsize
+    samples = numpy.frombuffer(snddata.data, dtype=dtype, count=count)
+    return samples.reshape(-1, snddata.channels)
+
+
+def _downmix_samples(samples):
+    """Averages the channels of a (frames, channels) array."""
+    mixed = samples.mean(axis=1, dtype=numpy.float32)
+    if samples.dtype.kind == "f":
+        return mixed
+    return numpy.rint(mixed).astype(samples.dtype)
+
+
+def downmix(snddata, cached=True):
+    """Downmixes the SoundData to a mono SoundData by averaging its
+    channels.
+
+    OpenAL only spatializes mono sounds. If cached is True, the result is
+    kept as long as the passed SoundData exists and returned for it on the
+    next call. Mono SoundData objects are returned as they are.
+    """
+    if snddata.channels == 1:
+        return snddata
+    if cached:
+        mono = _monocache.get(snddata, None)
+        if mono is not None:
+            return mono
+    samples = _downmix_samples(_get_samples(snddata))
+    mono = SoundData(samples, 1, snddata.bitrate, samples.nbytes,
+                     snddata.frequency)
+    if cached:
+        _monocache[snddata] = mono
+    return mono
+
+
+def _resample_filter(phases, up, cutoff, half):
+    """Calculates the windowed sinc filter coefficients for the passed
+    phases, which are fractions of up between two input samples."""
+    offsets = numpy.arange(1 - half, half + 1, dtype=numpy.float64)
+    x = offsets[None, :] - (phases / up)[:, None]
+    window = (0.42 + 0.5 * numpy.cos(numpy.pi * x / half) +
+              0.08 * numpy.cos(2 * numpy.pi * x / half))
+    coefs = numpy.sinc(cutoff * x) * window
+    # Normalize each phase, so that constant signals keep their level.
+    coefs /= coefs.sum(axis=1, keepdims=True)
+    return coefs.astype(numpy.float32)
+
+
+def _resample_samples(samples, source, target):
+    """Resamples a (frames, channels) array from the source to the target
+    frequency with a polyphase windowed sinc filter."""
+    divisor = math.gcd(source, target)
+    up, down = target // divisor, source // divisor
+    frames = len(samples)
+    count = -(-frames * up // down)
+    # Lower the cutoff below the target Nyquist frequency on downsampling
+    # and widen the filter accordingly.
+    cutoff = min(1.0, up / down)
+    half = int(math.ceil(_ZEROCROSSINGS / cutoff))
+
+    positions = numpy.arange(count, dtype=numpy.int64) * down
+    index, phase = numpy.divmod(positions, up)
+    # Only calculate the filter once for each phase in use.
+    phases, inverse = numpy.unique(phase, return_inverse=True)
+    coefs = _resample_filter(phases.astype(numpy.float64), up, cutoff, half)
+
+    # Pad the samples with silence for the filter taps beyond the edges.
+    padded = numpy.zeros((frames + 2 * half, samples.shape[1]),
+                         dtype=numpy.float32)
+    padded[half:half + frames] = samples
+    if samples.dtype == numpy.uint8:
+        padded[half:half + frames] -= 128
+    result = numpy.zeros((count, samples.shape[1]), dtype=numpy.float32)
+    for tap in range(2 * half):
+        result += coefs[inverse, tap][:, None] * padded[index + tap + 1]
+
+    if samples.dtype == numpy.uint8:
+        result += 128
+    if samples.dtype.kind == "f":
+        return result
+    info = numpy.iinfo(samples.dtype)
+    numpy.rint(result, out=result)
+    numpy.clip(result, info.min, info.max, out=result)
+    return result.astype(samples.dtype)
+
+
+def resample(snddata, frequency, cached=True):
+    """Resamples the SoundData to the passed frequency.
+
+    OpenAL resamples sounds, which do not match the mixing frequency of the
+    device, on each playback. Resampling them once on loading avoids that
+    and uses a higher quality windowed sinc filter. If cached is True, the
+    result is kept as long as the passed SoundData exists and returned for
+    it on the next call with the same frequency. SoundData objects, which
+    already have the frequency, are returned as they are.
+    """
+    if snddata.frequency == frequency:
+        return snddata
+    if not snddata.frequency or frequency <= 0:
+        raise ValueError("can not resample from %r to %r Hz" %
+                         (snddata.frequency, frequency))
+    if cached:
+        rates = _ratecache.setdefault(snddata, {})
+        result = rates.get(frequency, None)
+        if result is not None:
+            return result
+    samples = _resample_samples(_get_samples(snddata), snddata.frequency,
+                                frequency)
+    result = SoundData(samples, snddata.channels, snddata.bitrate,
+                       samples.nbytes, frequency)
+    if cached:
+        rates[frequency] = result
+    return result
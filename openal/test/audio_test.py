@@ -1,8 +1,9 @@
 import sys
 import unittest
-from .. import al
-from ..audio import OpenALError, SoundData, SoundListener, SoundSource, \
-    SoundSink
+from .. import al, audio
+from ..audio import OpenALError, SoundData, StreamingSoundData, \
+    SoundListener, SoundSource, SourcePool, BufferCache, SoundSink, \
+    LoopbackSoundSink, get_buffer_format
 
 
 class OpenALAudioTest(unittest.TestCase):
@@ -27,6 +28,47 @@ class OpenALAudioTest(unittest.TestCase):
         self.assertIsNone(data.data)
         self.assertIsNone(data.bitrate)
 
+    def test_SoundData_buffers(self):
+        import array
+        import numpy
+        data = SoundData(b"\x00" * 32, 1, 16, frequency=44100)
+        self.assertEqual(data.size, 32)
+        self.assertEqual(data.format, al.AL_FORMAT_MONO16)
+        data = SoundData(bytearray(32), 2, 16, frequency=44100)
+        self.assertEqual(data.size, 32)
+        self.assertEqual(data.format, al.AL_FORMAT_STEREO16)
+        data = SoundData(memoryview(bytearray(32)), 1, 8, frequency=44100)
+        self.assertEqual(data.size, 32)
+        data = SoundData(array.array("h", [0] * 16), 1, 16, frequency=44100)
+        self.assertEqual(data.size, 32)
+        buf = numpy.zeros((8, 2), dtype=numpy.int16)
+        data = SoundData(buf, 2, 16, frequency=44100)
+        self.assertEqual(data.size, 32)
+        self.assertIs(data.data, buf)
+        data = SoundData(buf, 2, 16, 16, 44100)
+        self.assertEqual(data.size, 16)
+
+    def test_get_buffer_format(self):
+        sink = SoundSink()
+        sink.activate()
+        self.assertEqual(get_buffer_format(1, 16), al.AL_FORMAT_MONO16)
+        self.assertEqual(get_buffer_format(2, 8), al.AL_FORMAT_STEREO8)
+        self.assertIsNone(get_buffer_format(3, 16))
+        self.assertIsNone(get_buffer_format(1, 24))
+        float32 = get_buffer_format(1, 32)
+        if al.alIsExtensionPresent(b"AL_EXT_float32") == b"\x01":
+            self.assertIsNotNone(float32)
+
+        # Extension formats are resolved on playing the sound.
+        snddata = SoundData(b"\x00" * 4 * 6 * 100, 6, 32, frequency=44100)
+        self.assertIsNone(snddata.format)
+        source = SoundSource(gain=0.0)
+        source.queue(snddata)
+        sink.play(source)
+        sink.update()
+        self.assertEqual(snddata.format, get_buffer_format(6, 32))
+        del sink
+
     def test_SoundData_frequency(self):
         data = SoundData()
         vals = ("test", 1, -1, None, self)
@@ -105,6 +147,7 @@ class OpenALAudioTest(unittest.TestCase):
         self.assertEqual(source.gain, source.dataproperties[al.AL_GAIN])
         self.assertEqual(source.position, source.dataproperties[al.AL_POSITION])
         self.assertEqual(source.velocity, source.dataproperties[al.AL_VELOCITY])
+        self.assertEqual(source.priority, 0)
         self.assertTrue(source.changed)
 
     def test_SoundSource_props(self):
@@ -140,6 +183,383 @@ class OpenALAudioTest(unittest.TestCase):
                 self.assertTrue(source.changed)
                 self.assertTrue(dprop in source.changedproperties)
 
+    def test_add_source_extension(self):
+        sink = SoundSink()
+        sink.activate()
+        self.assertFalse(audio.add_source_extension(
+            b"AL_PYAL_invalid", 0x1033, 1, al.ALint, al.alGetSourcei,
+            al.alSourcei))
+        self.assertFalse(audio.add_listener_extension(
+            "AL_PYAL_invalid", 0x1033, 1, al.ALfloat, al.alGetListenerf,
+            al.alListenerf))
+        if not audio._has_extension(b"AL_SOFT_direct_channels"):
+            del sink
+            self.skipTest("AL_SOFT_direct_channels is not supported")
+        # AL_DIRECT_CHANNELS_SOFT
+        prop = 0x1033
+        try:
+            self.assertTrue(audio.add_source_extension(
+                "AL_SOFT_direct_channels", prop, 1, al.ALint,
+                al.alGetSourcei, al.alSourcei))
+            source = SoundSource()
+            sink.process_source(source)
+            sid = sink._sources[source]
+            audio._set_source_value(sid, prop, 1)
+            self.assertEqual(audio._get_source_value(sid, prop), 1)
+        finally:
+            for mapping in (audio._SOURCECALLBACKS, audio._SOURCESETTERS,
+                            audio._SOURCEGETTERS):
+                mapping.pop(prop, None)
+            audio._SOURCEPROPMAP.pop("al.AL_AL_SOFT_DIRECT_CHANNELS", None)
+        del sink
+
+    def test_SourcePool(self):
+        pool = SourcePool(10, gain=0.5)
+        self.assertEqual(len(pool), 10)
+        self.assertEqual(pool.position.shape, (10, 3))
+        self.assertEqual(pool.velocity.shape, (10, 3))
+        self.assertEqual(pool.direction.shape, (10, 3))
+        self.assertEqual(pool.gain.shape, (10,))
+        self.assertEqual(pool.pitch.shape, (10,))
+        self.assertEqual(pool.gain[0], 0.5)
+        self.assertEqual(pool.pitch[0], 1.0)
+        self.assertTrue(pool.changed)
+
+        pool.dirty[:] = 0
+        self.assertFalse(pool.changed)
+        pool.set("position", (1, 2, 3), slice(2, 4))
+        self.assertEqual(pool.position[2].tolist(), [1, 2, 3])
+        self.assertEqual(pool.position[4].tolist(), [0, 0, 0])
+        self.assertEqual(pool.dirty.tolist(),
+                         [0, 0, 1, 1, 0, 0, 0, 0, 0, 0])
+        pool.gain *= 0.5
+        pool.mark_dirty("gain")
+        self.assertTrue(all(pool.dirty & SourcePool.GAIN))
+        self.assertRaises(KeyError, pool.set, "looping", 1)
+
+    def test_SoundSink_process_pool(self):
+        sink = SoundSink()
+        sink.activate()
+        pool = SourcePool(4)
+        sink.process_pool(pool)
+        self.assertFalse(pool.changed)
+        pool.set("gain", 0.25, 1)
+        sink.update()
+        self.assertFalse(pool.changed)
+        del sink
+
+    def test_SoundSink_pool_sources(self):
+        sink = SoundSink(max_sources=20)
+        sink.activate()
+        source = SoundSource(gain=0.0)
+        source.queue(SoundData(b"\x00" * 4410, 1, 8, frequency=44100))
+        sink.process_source(source)
+        self.assertEqual(len(sink._sids), SoundSink.SOURCE_CHUNK_SIZE)
+        # The pool takes the unused ids of the sink.
+        sink.process_pool(SourcePool(12))
+        self.assertEqual(len(sink._sids), 8)
+        self.assertEqual(len(sink._sids) + sink._poolsids, 20)
+        self.assertRaises(OpenALError, sink.process_pool, SourcePool(8))
+        sink.stop(source)
+        del sink
+
+    def test_SoundSink_buffers(self):
+        import numpy
+        sink = SoundSink()
+        sink.activate()
+        source = SoundSource()
+        source.gain = 0.0
+        for buf in (bytearray(64), memoryview(b"\x00" * 64),
+                    numpy.zeros(32, dtype=numpy.int16)):
+            source.queue(SoundData(buf, 1, 16, frequency=44100))
+        sink.process_source(source)
+        self.assertEqual(source.bufferqueue, [])
+        sink.stop(source)
+        del sink
+
+    def test_SoundSink_streaming(self):
+        import io
+        stream = io.BytesIO(b"\x00" * 100000)
+        data = StreamingSoundData(stream, 1, 16, 100000, 44100)
+        sink = SoundSink()
+        sink.activate()
+        source = SoundSource()
+        source.gain = 0.0
+        source.queue(data)
+        sink.process_source(source)
+        # 100000 bytes fit into three buffers of MAX_BUFFER_SIZE bytes.
+        self.assertEqual(source.bufferqueue, [])
+        # The exhausted stream is closed.
+        self.assertTrue(stream.closed)
+        self.assertEqual(len(sink._freebufs), SoundSink.BUFFER_CHUNK_SIZE - 3)
+        sink.stop(source)
+        # The processed buffers are kept for reuse.
+        sink.process_source(source)
+        self.assertEqual(len(sink._freebufs), SoundSink.BUFFER_CHUNK_SIZE)
+        del sink
+
+    def test_SoundSink_feeder(self):
+        import threading
+        sink = SoundSink()
+        self.assertFalse(sink.feeding)
+        called = threading.Event()
+        threads = []
+
+        def command(value):
+            threads.append((threading.current_thread(), value))
+            called.set()
+
+        sink.start_feeder(0.005)
+        self.assertTrue(sink.feeding)
+        self.assertRaises(RuntimeError, sink.start_feeder)
+        sink.post(command, 42)
+        self.assertTrue(called.wait(5))
+        sink.stop_feeder()
+        self.assertFalse(sink.feeding)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0][0], threading.current_thread())
+        self.assertEqual(threads[0][1], 42)
+
+        # Unknown extensions must not be reported as present.
+        self.assertFalse(audio._has_extension(b"ALC_PYAL_invalid",
+                                              sink.device))
+        self.assertFalse(audio._has_extension(b"AL_PYAL_invalid"))
+
+        # Without the feeder, commands are executed by update().
+        called.clear()
+        sink.post(command, 1)
+        self.assertFalse(called.is_set())
+        sink.update()
+        self.assertTrue(called.is_set())
+        del sink
+
+    def test_SoundSink_play_async(self):
+        import asyncio
+        sink = SoundSink()
+        sink.activate()
+        sources = [SoundSource(gain=0.0) for i in range(5)]
+        for source in sources:
+            source.queue(SoundData(b"\x00" * 441, 1, 8, frequency=44100))
+
+        async def run():
+            driver = asyncio.ensure_future(sink.run_async(0.001))
+            try:
+                return await asyncio.wait_for(
+                    asyncio.gather(*[sink.play_async(s) for s in sources]), 5)
+            finally:
+                driver.cancel()
+
+        done = asyncio.run(run())
+        self.assertEqual(done, sources)
+        self.assertEqual(sink._waiters, {})
+        del sink
+
+    def test_SoundSink_buffercache(self):
+        sink = SoundSink()
+        sink.activate()
+        cache = sink.buffercache
+        self.assertIsInstance(cache, BufferCache)
+        self.assertEqual(cache.budget, SoundSink.BUFFER_CACHE_SIZE)
+        data = SoundData(b"\x00" * 4410, 1, 8, frequency=44100)
+        sources = [SoundSource(gain=0.0) for i in range(3)]
+        for source in sources:
+            source.queue(data)
+            sink.process_source(source)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(data, cache)
+        self.assertEqual(cache.size, 4410)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 2)
+
+        # Queued buffers must not be evicted.
+        cache.clear()
+        self.assertIn(data, cache)
+        sink.stop(sources)
+        for source in sources:
+            sink.process_source(source)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+        # Cached, queued and free buffers are deleted on teardown.
+        sink.play(sources[0])
+        sources[1].queue(data)
+        sink.process_source(sources[1])
+        bufids = list(sink._freebufs) + [cache._entries[data][0]]
+        sink._delete_source_ids()
+        sink.activate()
+        for bufid in bufids:
+            self.assertEqual(ord(al.alIsBuffer(bufid)), al.AL_FALSE)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(sink._freebufs, [])
+        del sink
+
+    def test_SoundSink_voices(self):
+        sink = SoundSink(max_sources=2)
+        sink.activate()
+        self.assertEqual(sink.max_sources, 2)
+        low = SoundSource(gain=0.0, priority=0)
+        high = SoundSource(gain=0.0, priority=5)
+        higher = SoundSource(gain=0.0, priority=10)
+        for source in (low, high, higher):
+            source.queue(SoundData(b"\x00" * 44100, 1, 8, frequency=44100))
+        sink.process_source(low)
+        sink.process_source(high)
+        # The pool is exhausted, the source with the lowest priority loses
+        # its id.
+        sink.process_source(higher)
+        self.assertNotIn(low, sink._sources)
+        self.assertEqual(low._activesets, [])
+        self.assertIn(high, sink._sources)
+        self.assertIn(higher, sink._sources)
+        self.assertRaises(OpenALError, sink.process_source,
+                          SoundSource(priority=1))
+
+        # Stopped sources give their ids back.
+        sink.stop(high)
+        sink.update()
+        self.assertNotIn(high, sink._sources)
+        self.assertEqual(len(sink._freesids), 1)
+        self.assertEqual(len(sink._sids), 2)
+        sink.stop(higher)
+        del sink
+
+    def test_SoundSink_unfed_source(self):
+        sink = SoundSink()
+        sink.activate()
+        source = SoundSource()
+        # OpenAL reports a source played without buffers as stopped, it
+        # must keep its id nevertheless.
+        sink.play(source)
+        sink.update()
+        sink.update()
+        self.assertIn(source, sink._sources)
+        source.queue(SoundData(b"\x80" * 441, 1, 8, frequency=44100))
+        sink.update()
+        self.assertIn(source, sink._fedsources)
+        del sink
+
+    def test_SoundSink_error_policy(self):
+        import os
+        sink = SoundSink()
+        sink.activate()
+        self.assertEqual(sink.error_policy, "strict")
+        self.assertRaises(ValueError, setattr, sink, "error_policy", "never")
+        source = SoundSource(gain=0.0)
+
+        sink.error_policy = "per-update"
+        # The buffer cache follows the policy of the sink.
+        self.assertEqual(sink.buffercache.check, sink._check)
+        al.alSourcePlay(0xFFFFFF)
+        sink.play(source)
+        self.assertRaises(OpenALError, sink.update)
+        sink.update()
+
+        sink.error_policy = "off"
+        al.alSourcePlay(0xFFFFFF)
+        sink.update()
+        self.assertNotEqual(al.alGetError(), al.AL_NO_ERROR)
+
+        sink.error_policy = "strict"
+        al.alSourcePlay(0xFFFFFF)
+        self.assertRaises(OpenALError, sink.play, source)
+        del sink
+
+        os.environ["PYAL_ERROR_POLICY"] = "off"
+        try:
+            sink = SoundSink()
+            self.assertEqual(sink.error_policy, "off")
+            del sink
+            sink = SoundSink(error_policy="per-update")
+            self.assertEqual(sink.error_policy, "per-update")
+            del sink
+        finally:
+            del os.environ["PYAL_ERROR_POLICY"]
+
+    def test_SoundSink_refresh(self):
+        sink = SoundSink()
+        sink.activate()
+        source = SoundSource(gain=0.5, position=[1, 2, 3])
+        self.assertRaises(ValueError, sink.refresh, source)
+        source.queue(SoundData(b"\x80" * 44100, 1, 8, frequency=44100))
+        sink.play(source)
+        sink.update()
+        sink.update()
+        sink.refresh(source)
+        self.assertAlmostEqual(source.gain, 0.5)
+        self.assertEqual(source.position, [1.0, 2.0, 3.0])
+        self.assertIsInstance(source.looping, int)
+        sink.stop(source)
+        del sink
+
+    def test_SoundSink_snapshot(self):
+        sink = SoundSink()
+        sink.activate()
+        sources = [SoundSource(gain=0.5, position=[i, 0, 0])
+                   for i in range(3)]
+        for source in sources:
+            source.queue(SoundData(b"\x80" * 44100, 1, 8, frequency=44100))
+            sink.play(source)
+        sink.update()
+        sink.update()
+        snapshot = sink.snapshot()
+        self.assertEqual(len(snapshot), 3)
+        for index, row in enumerate(snapshot):
+            self.assertEqual(row["sid"], sink._sources[sources[index]])
+            self.assertAlmostEqual(row["gain"], 0.5)
+            self.assertEqual(list(row["position"]), [index, 0, 0])
+        snapshot = sink.snapshot([sources[1], SoundSource()], ["gain"])
+        self.assertEqual(len(snapshot), 2)
+        self.assertAlmostEqual(snapshot[0]["gain"], 0.5)
+        self.assertEqual(list(snapshot[0]["position"]), [0, 0, 0])
+        self.assertEqual(snapshot[1]["sid"], 0)
+        self.assertRaises(ValueError, sink.snapshot, None, ["pitch"])
+        sink.stop(sources)
+        del sink
+
+    def test_SoundSink_frame(self):
+        sink = SoundSink()
+        sink.activate()
+        self.assertRaises(RuntimeError, sink.end_frame)
+        source = SoundSource(gain=0.5)
+        source.queue(SoundData(b"\x80" * 44100, 1, 8, frequency=44100))
+        sink.play(source)
+        sink.begin_frame()
+        sink.begin_frame()
+        source.gain = 0.25
+        sink.update()
+        sink.end_frame()
+        sink.end_frame()
+        sink.refresh(source)
+        self.assertAlmostEqual(source.gain, 0.25)
+        self.assertRaises(RuntimeError, sink.end_frame)
+        sink.stop(source)
+        del sink
+
+    def test_SoundSink_pushes(self):
+        sink = SoundSink()
+        sink.activate()
+        source = SoundSource(gain=0.5, position=[1, 2, 3])
+        source.queue(SoundData(b"\x80" * 44100, 1, 8, frequency=44100))
+        sink.play(source)
+        sink.update()
+        pushes, skipped = sink.pushes, sink.skipped_pushes
+        source.position = (1, 2, 3)
+        source.gain = 0.5
+        sink.update()
+        self.assertEqual(sink.pushes, pushes)
+        self.assertEqual(sink.skipped_pushes, skipped + 2)
+        source.position = [1, 2, 3.001]
+        sink.update()
+        self.assertEqual(sink.pushes, pushes + 1)
+        sink.PUSH_EPSILON = 0.01
+        source.position = [1, 2, 3]
+        sink.update()
+        self.assertEqual(sink.pushes, pushes + 1)
+        self.assertEqual(sink.skipped_pushes, skipped + 3)
+        sink.stop(source)
+        del sink
+
     def test_SoundSink(self):
         sink = SoundSink()
         self.assertIsNotNone(sink.device)
@@ -149,6 +569,74 @@ class OpenALAudioTest(unittest.TestCase):
         #self.assertEqual(sink2.device, sink.device)
         del sink
 
+    def test_SoundSink_active_only(self):
+        sink = SoundSink(active_only=True)
+        sink.activate()
+        self.assertTrue(sink.active_only)
+        source = SoundSource()
+        sink.process_source(source)
+        self.assertFalse(source.changed)
+        self.assertNotIn(source, sink._active)
+        source.gain = 0.5
+        self.assertIn(source, sink._active)
+        sink.update()
+        self.assertNotIn(source, sink._active)
+        source.queue(SoundData())
+        self.assertIn(source, sink._active)
+        self.assertEqual(len(source._activesets), 1)
+        del sink
+        # The source must not keep the active set of the sink alive.
+        self.assertEqual(source._activesets, [])
+
+    def test_SoundSink_events(self):
+        import time
+        sink = SoundSink(active_only=True)
+        sink.activate()
+        source = SoundSource(gain=0.0)
+        source.queue(SoundData(b"\x00" * 441, 1, 8, frequency=44100))
+        sink.play(source)
+        sink.update()
+        self.assertIsInstance(sink.event_driven, bool)
+        if sink.event_driven:
+            # Playing sources are not polled, but woken up by events.
+            self.assertNotIn(source, sink._active)
+        deadline = time.time() + 5
+        while source in sink._sources and time.time() < deadline:
+            time.sleep(0.01)
+            sink.update()
+        self.assertNotIn(source, sink._sources)
+        del sink
+
+    def test_LoopbackSoundSink(self):
+        import gc
+        import numpy
+        # Sinks, which failed on creation, must be finalized silently.
+        unraisable = []
+        hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+        try:
+            self.assertRaises(ValueError, LoopbackSoundSink, channels=3)
+            self.assertRaises(ValueError, LoopbackSoundSink, dtype="float64")
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+        self.assertEqual(unraisable, [])
+        sink = LoopbackSoundSink(22050, 1, "int16")
+        self.assertTrue(sink.opened_device)
+        self.assertEqual(sink.frequency, 22050)
+        sink.activate()
+        source = SoundSource()
+        source.queue(SoundData(b"\x7f" * 4410, 1, 8, frequency=22050))
+        sink.play(source)
+        sink.update()
+        block = sink.render(1024)
+        self.assertEqual(block.shape, (1024, 1))
+        self.assertEqual(block.dtype, numpy.int16)
+        self.assertTrue(block.any())
+        out = numpy.zeros((512, 1), dtype=numpy.int16)
+        self.assertIs(sink.render(512, out), out)
+        self.assertRaises(ValueError, sink.render, 256, out)
+        del sink
+
 
 if __name__ == "__main__":
     sys.exit(unittest.main())
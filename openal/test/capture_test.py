@@ -0,0 +1,58 @@
+import sys
+import unittest
+from .. import al, capture
+from ..capture import CaptureDevice
+
+
+class OpenALCaptureTest(unittest.TestCase):
+
+    def test_get_capture_format(self):
+        # The formats are resolved without requiring a current context.
+        self.assertEqual(capture._get_capture_format(1, 16),
+                         al.AL_FORMAT_MONO16)
+        self.assertIsNotNone(capture._get_capture_format(2, 32))
+        self.assertIsNone(capture._get_capture_format(3, 16))
+        self.assertIsNone(capture._get_capture_format(1, 24))
+
+    def test_CaptureDevice(self):
+        self.assertRaises(ValueError, CaptureDevice, channels=3)
+        device = CaptureDevice(frequency=8000, ringsize=4000)
+        self.assertEqual(len(device.ring), 4000)
+        self.assertEqual(len(device), 0)
+        self.assertIsNone(device.read(100))
+        self.assertRaises(ValueError, device.read, 4001)
+        device.close()
+        self.assertIsNone(device.device)
+
+    def test_CaptureDevice_frames(self):
+        with CaptureDevice(frequency=8000, channels=1) as device:
+            self.assertTrue(device.capturing)
+            blocks = device.frames(800)
+            for i in range(3):
+                block = next(blocks)
+                self.assertEqual(block.shape, (800, 1))
+            device.stop()
+            self.assertFalse(device.capturing)
+            for block in blocks:
+                self.assertEqual(block.shape, (800, 1))
+
+    def test_CaptureDevice_frames_async(self):
+        import asyncio
+
+        async def capture(device):
+            blocks = []
+            async for block in device.frames_async(400):
+                blocks.append(block.copy())
+                if len(blocks) == 3:
+                    device.stop()
+            return blocks
+
+        with CaptureDevice(frequency=8000, channels=2) as device:
+            blocks = asyncio.run(capture(device))
+        self.assertGreaterEqual(len(blocks), 3)
+        for block in blocks:
+            self.assertEqual(block.shape, (400, 2))
+
+
+if __name__ == "__main__":
+    sys.exit(unittest.main())
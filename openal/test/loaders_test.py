@@ -1,6 +1,9 @@
 import os
 import sys
+import tempfile
 import unittest
+import wave
+from unittest import mock
 from .. import al, loaders
 
 RESPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
@@ -16,6 +19,285 @@ class OpenALAudioTest(unittest.TestCase):
         self.assertEqual(snddata.frequency, 44100)
         self.assertEqual(snddata.size, 122880)
 
+    def test_load_files(self):
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        missing = os.path.join(RESPATH, "missing.wav")
+        for processes in (False, True):
+            sounds = loaders.load_files([wavfile, wavfile], workers=2,
+                                        processes=processes)
+            self.assertEqual(len(sounds), 2)
+            for snddata in sounds:
+                self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+                self.assertEqual(snddata.size, 122880)
+
+        errors = {}
+        sounds = loaders.load_files([missing, wavfile], errors=errors)
+        self.assertIsNone(sounds[0])
+        self.assertEqual(sounds[1].size, 122880)
+        self.assertEqual(list(errors), [missing])
+        self.assertRaises(Exception, loaders.load_files, [wavfile, missing])
+
+    def test_PCMCache(self):
+        import shutil
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        cachedir = tempfile.mkdtemp()
+        try:
+            cache = loaders.PCMCache(cachedir, max_size=200000)
+            self.assertIsNone(cache.get(wavfile, "int16"))
+            snddata = loaders.load_file(wavfile)
+            cache.put(wavfile, "int16", snddata)
+            self.assertGreater(cache.size, 122880)
+
+            cached = cache.get(wavfile, "int16")
+            self.assertIsInstance(cached.data, memoryview)
+            self.assertEqual(cached.format, snddata.format)
+            self.assertEqual(cached.frequency, snddata.frequency)
+            self.assertEqual(bytes(cached.data), bytes(snddata.data))
+            del cached
+
+            # A second entry exceeds max_size and evicts the first one.
+            cache.put(wavfile, "other", snddata)
+            self.assertIsNone(cache.get(wavfile, "int16"))
+            self.assertIsNotNone(cache.get(wavfile, "other"))
+
+            # Corrupted entries are discarded, when they are loaded for the
+            # first time.
+            entry = cache._entry(wavfile, "other")
+            with open(entry, "r+b") as fp:
+                fp.seek(-1, os.SEEK_END)
+                fp.write(b"\xff")
+            self.assertIsNotNone(cache.get(wavfile, "other"))
+            cache = loaders.PCMCache(cachedir, max_size=200000)
+            self.assertIsNone(cache.get(wavfile, "other"))
+            self.assertFalse(os.path.exists(entry))
+
+            sounds = loaders.load_files([wavfile], processes=True,
+                                        cache=cache)
+            self.assertIsInstance(sounds[0].data, memoryview)
+            del sounds
+            cache.clear()
+            self.assertEqual(cache.size, 0)
+
+            # The directory is scanned once and not on every put().
+            cache = loaders.PCMCache(cachedir)
+            with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+                for fmt in ("a", "b", "c", "c"):
+                    cache.put(wavfile, fmt, snddata)
+                self.assertEqual(scandir.call_count, 1)
+            self.assertEqual(cache._total, cache.size)
+            cache.max_size = cache.size - 1
+            cache.put(wavfile, "d", snddata)
+            self.assertIsNone(cache.get(wavfile, "a"))
+            self.assertEqual(cache._total, cache.size)
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_bank(self):
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        snddata = loaders.load_file(wavfile)
+        fd, fname = tempfile.mkstemp(suffix=".bank")
+        os.close(fd)
+        try:
+            loaders.build_bank(fname, [("hey", wavfile),
+                                       ("hey2", snddata)])
+            with loaders.open_bank(fname) as bank:
+                self.assertEqual(len(bank), 2)
+                self.assertEqual(bank.names(), ["hey", "hey2"])
+                self.assertIn("hey", bank)
+                self.assertIsNone(bank.get("missing"))
+                self.assertRaises(KeyError, bank.__getitem__, "missing")
+                sound = bank["hey"]
+                self.assertIs(bank["hey"], sound)
+                self.assertIsInstance(sound.data, memoryview)
+                self.assertEqual(sound.format, al.AL_FORMAT_MONO16)
+                self.assertEqual(sound.frequency, 44100)
+                self.assertEqual(sound.size, 122880)
+                self.assertEqual(bytes(bank["hey2"].data),
+                                 bytes(snddata.data))
+                del sound
+            self.assertRaises(ValueError, loaders.open_bank, wavfile)
+
+            # The data of a truncated bank is not handed out.
+            with open(fname, "r+b") as fp:
+                fp.truncate(os.path.getsize(fname) - 1024)
+            with loaders.open_bank(fname) as bank:
+                self.assertRaises(ValueError, bank.__getitem__, "hey2")
+        finally:
+            os.remove(fname)
+
+    def test_float32_roundtrip(self):
+        import shutil
+        import numpy
+        from ..audio import SoundData
+        samples = numpy.linspace(-1, 1, 64, dtype=numpy.float32)
+        snddata = SoundData(samples.reshape(-1, 2), 2, 32, frequency=22050)
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        cachedir = tempfile.mkdtemp()
+        fd, fname = tempfile.mkstemp(suffix=".bank")
+        os.close(fd)
+        try:
+            cache = loaders.PCMCache(cachedir)
+            cache.put(wavfile, "float32", snddata)
+            cached = cache.get(wavfile, "float32")
+            self.assertEqual((cached.channels, cached.bitrate), (2, 32))
+            self.assertEqual(cached.frequency, 22050)
+            self.assertEqual(bytes(cached.data), samples.tobytes())
+            del cached
+
+            loaders.build_bank(fname, [("float", snddata)])
+            with loaders.open_bank(fname) as bank:
+                sound = bank["float"]
+                self.assertEqual((sound.channels, sound.bitrate), (2, 32))
+                self.assertEqual(sound.frequency, 22050)
+                self.assertEqual(bytes(sound.data), samples.tobytes())
+                del sound
+        finally:
+            shutil.rmtree(cachedir)
+            os.remove(fname)
+
+    def test_load_wav_file_mmap(self):
+        import struct
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        snddata = loaders.load_wav_file(wavfile)
+        self.assertIsInstance(snddata.data, memoryview)
+        self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+        self.assertEqual(snddata.frequency, 44100)
+        self.assertEqual(snddata.size, 122880)
+
+        fd, fname = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            # 24 bit stereo samples
+            fp = wave.open(fname, "wb")
+            fp.setnchannels(2)
+            fp.setsampwidth(3)
+            fp.setframerate(8000)
+            fp.writeframes(b"\x00\x34\x12\x00\xff\xff" * 4)
+            fp.close()
+            snddata = loaders.load_wav_file(fname, "int16")
+            self.assertEqual(snddata.format, al.AL_FORMAT_STEREO16)
+            self.assertEqual(list(snddata.data), [0x1234, -1] * 4)
+
+            # WAVE_FORMAT_EXTENSIBLE float samples with an extra chunk and
+            # a truncated data chunk
+            data = struct.pack("<3f", 0.5, -1.0, 2.0)
+            fmt = struct.pack("<HHIIHHHHIH14x", 0xFFFE, 1, 8000, 32000, 4,
+                              32, 22, 32, 4, 3)
+            riff = b"WAVEfmt " + struct.pack("<I", len(fmt)) + fmt + \
+                b"LIST" + struct.pack("<I", 3) + b"abc\x00" + \
+                b"data" + struct.pack("<I", len(data) + 100) + data
+            with open(fname, "wb") as fp:
+                fp.write(b"RIFF" + struct.pack("<I", len(riff)) + riff)
+            snddata = loaders.load_wav_file(fname, "int16")
+            self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+            self.assertEqual(snddata.size, 6)
+            self.assertEqual(list(snddata.data), [16383, -32767, 32767])
+            snddata = loaders.load_wav_file(fname, "float32")
+            self.assertEqual(snddata.bitrate, 32)
+            self.assertIsInstance(snddata.data, memoryview)
+            self.assertEqual(list(snddata.data.cast("f")), [0.5, -1.0, 2.0])
+            self.assertRaises(ValueError, loaders.load_wav_file, fname,
+                              "int8")
+
+            with open(fname, "wb") as fp:
+                fp.write(b"RIFF\x04\x00\x00\x00WAVE")
+            self.assertRaises(ValueError, loaders.load_wav_file, fname)
+        finally:
+            os.remove(fname)
+
+    def test_downmix(self):
+        import numpy
+        from ..audio import SoundData
+        samples = numpy.array([[100, 200], [-6, -8], [32767, 32767]],
+                              dtype=numpy.int16)
+        snddata = SoundData(samples, 2, 16, frequency=22050)
+        mono = loaders.downmix(snddata)
+        self.assertEqual(mono.format, al.AL_FORMAT_MONO16)
+        self.assertEqual(mono.frequency, 22050)
+        self.assertEqual(mono.size, 6)
+        self.assertEqual(list(mono.data), [150, -7, 32767])
+        self.assertIs(loaders.downmix(snddata), mono)
+        self.assertIsNot(loaders.downmix(snddata, cached=False), mono)
+        self.assertIs(loaders.downmix(mono), mono)
+
+        snddata = SoundData(b"\x00\xff\x80\x82", 2, 8, frequency=8000)
+        self.assertEqual(list(loaders.downmix(snddata).data), [128, 129])
+
+        fd, fname = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            fp = wave.open(fname, "wb")
+            fp.setnchannels(2)
+            fp.setsampwidth(2)
+            fp.setframerate(22050)
+            fp.writeframes(b"\x02\x00\x04\x00" * 1000)
+            fp.close()
+            snddata = loaders.load_file(fname, mono=True)
+        finally:
+            os.remove(fname)
+        self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+        self.assertEqual(snddata.size, 2000)
+        self.assertEqual(list(snddata.data[:2]), [3, 3])
+
+    def test_resample(self):
+        import numpy
+        from ..audio import SoundData
+        times = numpy.arange(22050) / 22050
+        samples = (0.5 * numpy.sin(2 * numpy.pi * 441 * times))
+        snddata = SoundData(samples.astype(numpy.float32), 1, 32,
+                            frequency=22050)
+        result = loaders.resample(snddata, 44100)
+        self.assertEqual(result.frequency, 44100)
+        self.assertEqual(result.size, 44100 * 4)
+        expected = 0.5 * numpy.sin(2 * numpy.pi * 441 *
+                                   numpy.arange(44100) / 44100)
+        error = abs(numpy.frombuffer(result.data, numpy.float32) - expected)
+        self.assertLess(error[100:-100].max(), 1e-3)
+        self.assertIs(loaders.resample(snddata, 44100), result)
+        self.assertIsNot(loaders.resample(snddata, 44100, cached=False),
+                         result)
+        self.assertIs(loaders.resample(snddata, 22050), snddata)
+        self.assertRaises(ValueError, loaders.resample,
+                          SoundData(b"\x00\x00", 1, 16), 44100)
+
+        fd, fname = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            fp = wave.open(fname, "wb")
+            fp.setnchannels(2)
+            fp.setsampwidth(2)
+            fp.setframerate(48000)
+            fp.writeframes(b"\x00\x10\x00\xf0" * 4800)
+            fp.close()
+            snddata = loaders.load_file(fname, frequency=44100)
+        finally:
+            os.remove(fname)
+        self.assertEqual(snddata.format, al.AL_FORMAT_STEREO16)
+        self.assertEqual(snddata.frequency, 44100)
+        self.assertEqual(snddata.size, 4410 * 4)
+        samples = numpy.frombuffer(snddata.data, numpy.int16)
+        self.assertEqual(list(samples[2000:2002]), [4096, -4096])
+
+    def test_load_file_stereo(self):
+        fd, fname = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            fp = wave.open(fname, "wb")
+            fp.setnchannels(2)
+            fp.setsampwidth(2)
+            fp.setframerate(22050)
+            fp.writeframes(b"\x01\x00\x02\x00" * 1000)
+            fp.close()
+            snddata = loaders.load_file(fname)
+        finally:
+            os.remove(fname)
+
+        self.assertEqual(snddata.format, al.AL_FORMAT_STEREO16)
+        self.assertEqual(snddata.channels, 2)
+        self.assertEqual(snddata.frequency, 22050)
+        self.assertEqual(snddata.size, 4000)
+        self.assertEqual(bytes(snddata.data), b"\x01\x00\x02\x00" * 1000)
+
     def test_load_wav_file(self):
         wavfile = os.path.join(RESPATH, "hey.wav")
         snddata = loaders.load_wav_file(wavfile)
@@ -24,9 +306,44 @@ class OpenALAudioTest(unittest.TestCase):
         self.assertEqual(snddata.frequency, 44100)
         self.assertEqual(snddata.size, 122880)
 
-    @unittest.skip("not implemented")
+        # Path objects and file-like objects are accepted as well.
+        import pathlib
+        snddata = loaders.load_file(pathlib.Path(wavfile))
+        self.assertEqual(snddata.size, 122880)
+        with open(wavfile, "rb") as fp:
+            snddata = loaders.load_wav_file(fp)
+        self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+        self.assertEqual(snddata.frequency, 44100)
+        self.assertEqual(snddata.size, 122880)
+
     def test_load_stream(self):
-        pass
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        snddata = loaders.load_stream(wavfile, dtype="int16")
+
+        self.assertTrue(snddata.streaming)
+        self.assertEqual(snddata.format, al.AL_FORMAT_MONO16)
+        self.assertEqual(snddata.frequency, 44100)
+        self.assertEqual(snddata.size, 122880)
+
+        total = 0
+        while True:
+            block = memoryview(snddata.read(48000))
+            if block.nbytes == 0:
+                break
+            self.assertLessEqual(block.nbytes, 48000)
+            total += block.nbytes
+        self.assertEqual(total, 122880)
+        self.assertEqual(snddata.tell(), 122880)
+        snddata.seek(0)
+        self.assertEqual(snddata.tell(), 0)
+        self.assertEqual(memoryview(snddata.read(100)).nbytes, 100)
+
+    def test_load_stream_fileobj(self):
+        wavfile = os.path.join(RESPATH, "hey.wav")
+        with open(wavfile, "rb") as fp:
+            snddata = loaders.load_stream(fp, dtype="int16")
+            self.assertEqual(snddata.size, 122880)
+            self.assertEqual(memoryview(snddata.read(1000)).nbytes, 1000)
 
 
 if __name__ == "__main__":